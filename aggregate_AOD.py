@@ -0,0 +1,525 @@
+'''
+Script to calculate the average, maximum, minimum and other statistics of
+GOES-16 ABI AOD for day, month and year, reading each file only once
+
+The partial state (sum, count, max, min, ...) of each bin is saved, the month,
+season and year are obtained merging the states of the days instead of
+averaging the products. With update() only the scenes that are not in the
+manifest are folded in the states, and only the affected day, month and year
+are saved again. main('day') records the scenes of the states it saves in the
+manifest.
+
+With a memory budget (MB) the bins of scenes are aggregated by strips of rows
+aligned to the blocks of the rasters: only the accumulators of one strip are in
+memory and each strip of the products is written when it is finished.
+
+With cube=True the scenes are read from the datacube of the year (cube_AOD)
+instead of the GeoTIFF of each scene.
+
+The PNG are rendered without pyplot (render_AOD), with workers > 1 the maps of
+several bins are rendered in parallel.
+
+The scenes are read ahead in a pool of threads (depth files waiting at most)
+while the current one is accumulated.
+
+The products are written as float32 COG with the profile of the reference read
+once, by a thread in the background (output_AOD).
+
+With processes > 1 the bins are distributed in a pool of processes, each bin is
+written with the same names as in a single process, and the bins that fail are
+reported at the end.
+
+@author: urielm
+@date: 2026-10-18
+'''
+
+from glob import glob
+import os
+import json
+import datetime
+import math
+import resource
+from collections import deque
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+from group_AOD import groupFiles, parseDate
+from cube_AOD import cubePath, openCube, cubeDates, readScenes
+from read_AOD import fileFill, readFile
+from render_AOD import MAP_SIZE, renderPNG, renderBatch
+from output_AOD import outputProfile, prepareData, writeProduct, backgroundWriter, submitWrite, flushWrites
+from reduce_AOD import SCRATCH_BYTES, TIMES, timestamp, createState, updateRaw, finalizeState, timeProduct, \
+    saveState, loadState, mergeStates, checkState
+
+pathData = '/data/tmp/AOD_average/'
+pathState = pathData + 'state/'
+# Open the reference file
+ref = './data/ref/ref_AOD.tif'
+
+# The bins shorter than a month are obtained from the scenes
+SCENE_BINS = ('hour', 'day', 'pentad', 'week')
+# Bin of the inputs of the longer bins
+INPUT_BINS = {'month': 'day', 'season': 'day', 'year': 'month'}
+
+# Statistics always saved in the states of the scenes
+STATE_STATISTICS = ['mean', 'max', 'min', 'std', 'tmax']
+
+# Products: statistic, tag of the name, title, range of the plot and output directory
+PRODUCTS = {
+    'avr': {'statistic': 'mean', 'tag': 'avr', 'title': 'Average AOD',
+            'range': (-0.05, 5.00), 'path': pathData + 'averages/'},
+    'max': {'statistic': 'max', 'tag': 'max', 'title': 'Maximum AOD',
+            'range': (-0.05, 5.00), 'path': pathData + 'maximum/'},
+    'tmax': {'statistic': 'tmax', 'tag': 'tmax', 'title': 'Time of maximum AOD',
+             'range': None, 'path': pathData + 'maximum_time/'},
+    'min': {'statistic': 'min', 'tag': 'min', 'title': 'Minimum AOD',
+            'range': (-0.05, 5.00), 'path': pathData + 'minimum/'},
+    'std': {'statistic': 'std', 'tag': 'std', 'title': 'Standard deviation AOD',
+            'range': None, 'path': pathData + 'std/'},
+    'count': {'statistic': 'count', 'tag': 'count', 'title': 'Number of valid pixels AOD',
+              'range': None, 'path': pathData + 'count/'},
+    'first': {'statistic': 'first', 'tag': 'first', 'title': 'First valid time AOD',
+              'range': None, 'path': pathData + 'times/'},
+    'last': {'statistic': 'last', 'tag': 'last', 'title': 'Last valid time AOD',
+             'range': None, 'path': pathData + 'times/'},
+}
+
+def obtainProducts(products):
+    # The products can be given by name or as a dictionary
+    return [PRODUCTS[p] if isinstance(p, str) else p for p in products]
+
+def productInput(product, interval, year):
+    # Directory of the inputs of a bin
+    if interval in SCENE_BINS:
+        return pathData + 'geotiff/' + year + '/'
+    return product['path'] + INPUT_BINS[interval] + '/' + year + '/geotiff/'
+
+def productName(product, interval, year, date, ext):
+    # Name of the output of a product
+    folder = 'png' if ext == 'png' else 'geotiff'
+    name = 'CG_ABI-L2-AODC-' + product['tag'] + '-M6_G16_' + year
+    if interval != 'year':
+        name += date
+    return product['path'] + interval + '/' + year + '/' + folder + '/' + name + '.' + ext
+
+def statePath(interval, year, date):
+    # Name of the state of a bin
+    name = 'CG_ABI-L2-AODC-state-M6_G16_' + year
+    if interval != 'year':
+        name += date
+    return pathState + interval + '/' + year + '/' + name + '.npz'
+
+def readAhead(files, read=readFile, depth=4, workers=2, ordered=True):
+    # Yield (file, data) reading the next files in threads while the current
+    # one is used, at most depth files are read and waiting in memory
+    # ordered: False to yield the first file read (the time of the maximum can
+    # change only if two scenes have the same maximum)
+    if depth <= 0:
+        for file in files:
+            yield file, read(file)
+        return
+    files = iter(files)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque((file, executor.submit(read, file)) for file in islice(files, depth))
+        while pending:
+            if ordered:
+                file, future = pending.popleft()
+            else:
+                done, _ = wait([future for _, future in pending], return_when=FIRST_COMPLETED)
+                file, future = next(item for item in pending if item[1] in done)
+                pending.remove((file, future))
+            data = future.result()
+            # Read the next file while this one is used
+            fileNext = next(files, None)
+            if fileNext is not None:
+                pending.append((fileNext, executor.submit(read, fileNext)))
+            yield file, data
+
+def aggregate(files, statistics, scenes, state=None, fill_value=-32768.0, depth=4, ordered=True,
+              compact=False):
+    # Read each file once and update all the accumulators (of a new state or
+    # of a previous state) directly from the values of the file, the fill value
+    # of the scenes is ignored
+    # depth: files read ahead, 0 to read one by one
+    # compact: a new state of integer files is compact (see reduce_AOD)
+    for file, (aod, info) in readAhead(files, depth=depth, ordered=ordered):
+        print('Processing file: ', file)
+        if state is None:
+            if compact and aod.dtype.kind in 'iu':
+                state = createState(aod.shape, statistics, aod.dtype, info['scale'], info['offset'])
+            else:
+                state = createState(aod.shape, statistics)
+        updateRaw(state, aod, fileFill(info['nodata'], fill_value, scenes), info['scale'], info['offset'],
+                  t=timestamp(parseDate(file)))
+    return state
+
+def aggregateCube(nc, indices, dates, statistics, state=None):
+    # The same as aggregate with the scenes of the cube (NaN is the fill value)
+    for index, aod in readScenes(nc, indices):
+        if state is None:
+            state = createState(aod.shape, statistics)
+        updateRaw(state, aod, t=timestamp(dates[index]))
+    return state
+
+def productTitle(product, interval, year, date):
+    if interval != 'year':
+        return product['title'] + ' ' + year + ' ' + date
+    return product['title'] + ' ' + year
+
+def plotProduct(aod, product, interval, year, date):
+    # Plot the product, the AOD with the range : -0.05 to +5.00.
+    renderPNG(aod, productName(product, interval, year, date, 'png'),
+              productTitle(product, interval, year, date), product['range'])
+
+def saveProduct(aod, product, interval, year, date, profile, pngs=None, writer=None):
+    # pngs: list to add the map to render later, None to render now
+    # writer: background writer of the GeoTIFF, None to write now
+    if pngs is None:
+        plotProduct(aod, product, interval, year, date)
+    else:
+        pngs.append((aod, productName(product, interval, year, date, 'png'),
+                     productTitle(product, interval, year, date), product['range']))
+
+    # Save the product to a GeoTIFF file with rasterio
+    filename = productName(product, interval, year, date, 'tif')
+    if writer is None:
+        writeProduct(aod, filename, profile)
+    else:
+        submitWrite(writer, aod, filename, profile)
+
+def saveProducts(state, products, interval, year, date, profile, pngs=None, writer=None):
+    # Calculate and save all the products of the bin
+    for product in products:
+        aod = finalizeState(state, product['statistic'])
+        if product['statistic'] in TIMES:
+            aod = timeProduct(aod, interval)
+        saveProduct(aod, product, interval, year, date, profile, pngs, writer)
+
+def stateBytes(statistics):
+    # Bytes of the accumulators of one pixel
+    return sum(a.nbytes for a in createState((1,), statistics).values())
+
+def tileWindows(file, statistics, memory):
+    # Strips of rows of the raster aligned to its blocks, the accumulators, the
+    # buffer of reading, the temporaries of the update and the outputs (and
+    # its float32 copy) of a strip fit in the memory (MB)
+    with rasterio.open(file) as src:
+        height, width = src.height, src.width
+        blockRows = src.block_shapes[0][0]
+        pixel = stateBytes(statistics) + np.dtype(src.dtypes[0]).itemsize + SCRATCH_BYTES + \
+            (8 + 4) * len(statistics)
+    rows = int(memory * 2**20 // (pixel * width))
+    if rows >= blockRows:
+        rows = rows // blockRows * blockRows
+    rows = max(1, min(rows, height))
+    return [Window(0, row, width, min(rows, height - row)) for row in range(0, height, rows)]
+
+def aggregateTiled(files, products, interval, year, date, profile, memory, fill_value=-32768.0):
+    # Aggregate the files of a bin by strips, only the accumulators of a strip
+    # are in memory, the products are written strip by strip
+    statistics = [product['statistic'] for product in products]
+    scenes = interval in SCENE_BINS
+    times = [timestamp(parseDate(file)) for file in files]
+    windows = tileWindows(files[0], statistics, memory)
+    print('Strips: ', len(windows))
+    # The COG can not be written by windows, the strips are written in a tiled
+    # GeoTIFF with the same compression
+    profile = dict(profile, driver='GTiff', tiled=True, blockxsize=256, blockysize=256)
+    profile.pop('blocksize', None)
+    if 'predictor' in profile:
+        profile['predictor'] = 3
+    outputs = []
+    try:
+        for product in products:
+            outputs.append(rasterio.open(productName(product, interval, year, date, 'tif'), 'w', **profile))
+        for window in windows:
+            state = createState((window.height, window.width), statistics)
+            for file, t in zip(files, times):
+                aod, info = readFile(file, window)
+                updateRaw(state, aod, fileFill(info['nodata'], fill_value, scenes), info['scale'],
+                          info['offset'], t=t)
+            for product, dst in zip(products, outputs):
+                aod = finalizeState(state, product['statistic'])
+                if product['statistic'] in TIMES:
+                    aod = timeProduct(aod, interval)
+                dst.write(prepareData(aod, profile), 1, window=window)
+            del state
+    finally:
+        for dst in outputs:
+            dst.close()
+    # The plots are made from the products written, read decimated to the
+    # size of the map so the whole product is never in memory
+    for product in products:
+        with rasterio.open(productName(product, interval, year, date, 'tif')) as src:
+            step = max(1, math.ceil(max(src.height, src.width) / MAP_SIZE))
+            shape = (math.ceil(src.height / step), math.ceil(src.width / step))
+            aod = src.read(1, out_shape=shape, masked=True).filled(np.nan)
+        plotProduct(aod, product, interval, year, date)
+
+def processBin(interval, year, date, files, products, accumulate, rollup=False, states=True, memory=None,
+               nc=None, dates=None, profile=None, pngs=None, writer=None, depth=4, ordered=True,
+               compact=False):
+    # Aggregate one bin and save its products (and its state)
+    print(interval.capitalize() + ': ', date)
+    print('Number of files: ', len(files))
+    if memory is not None:
+        aggregateTiled(files, products, interval, year, date, profile, memory)
+        return
+    if rollup:
+        # Merge the states of the days
+        state = mergeStates(files)
+        checkState(state, [product['statistic'] for product in products])
+    elif nc is not None:
+        state = aggregateCube(nc, files, dates, accumulate)
+    else:
+        state = aggregate(files, accumulate, interval in SCENE_BINS, depth=depth, ordered=ordered,
+                          compact=compact)
+    if states:
+        saveState(state, statePath(interval, year, date))
+
+    saveProducts(state, products, interval, year, date, profile, pngs, writer)
+
+def limitMemory(limit):
+    # Limit the memory of a worker (MB), a bin that needs more fails with
+    # MemoryError instead of taking the memory of the node. RLIMIT_DATA limits
+    # the heap and the anonymous mappings, not the libraries and stacks
+    # inherited or reserved (RLIMIT_AS counts them)
+    if limit is not None:
+        size = int(limit * 2**20)
+        resource.setrlimit(resource.RLIMIT_DATA, (size, size))
+
+def runBin(job):
+    # Process a bin in a worker, the error is returned so a bad bin does not
+    # stop the others
+    args, options, cube = job
+    nc = None
+    try:
+        if cube:
+            # The cube can not be shared between processes
+            nc = openCube(args[1])
+            options = dict(options, nc=nc, dates=cubeDates(nc))
+        processBin(*args, **options)
+    except Exception as e:
+        return args[2], repr(e)
+    finally:
+        if nc is not None:
+            nc.close()
+    return args[2], None
+
+def main(interval, year, products, pathInput=None, states=True, only=None, memory=None, cube=False,
+         workers=1, depth=4, ordered=True, compress='deflate', nodata=np.nan, processes=1,
+         memoryLimit=None, compact=False):
+    # states: save the state of each bin and obtain the bins longer than a day
+    # merging the states of the days
+    # only: keys of the bins to process, all if None
+    # memory: budget in MB to aggregate by strips (the states are not saved)
+    # cube: read the scenes from the datacube of the year
+    # workers: processes to render the PNG by batches
+    # depth: files read ahead while the current one is accumulated, ordered:
+    # accumulate the files in order
+    # compress, nodata: compression and nodata of the GeoTIFF of the products
+    # processes: bins processed in parallel, memoryLimit: memory of each
+    # process in MB
+    # compact: integer scenes are accumulated in compact states
+    # Return the bins that failed (only with processes > 1)
+    products = obtainProducts(products)
+    statistics = [product['statistic'] for product in products]
+    scenes = interval in SCENE_BINS
+    if memory is not None:
+        states = False
+
+    # List all files in the input directory
+    # The DJF of a year begins in December of the previous year
+    previous = str(int(year) - 1)
+    rollup = False
+    if states and not scenes:
+        files = glob(pathState + 'day/' + year + '/*.npz')
+        rollup = len(files) > 0
+        if rollup and interval == 'season':
+            files += glob(pathState + 'day/' + previous + '/*.npz')
+        if not rollup:
+            print('There are no states of day for ' + year + ', the products are read')
+    nc = None
+    dates = None
+    names = None
+    if cube and scenes and memory is None:
+        if not os.path.exists(cubePath(year)):
+            raise FileNotFoundError('There is no cube for ' + year + ': ' + cubePath(year))
+        nc = openCube(year)
+        dates = cubeDates(nc)
+        names = list(nc.variables['scene'][:])
+        files = list(range(len(dates)))
+    elif not rollup:
+        if pathInput is None:
+            pathInput = productInput(products[0], interval, year)
+        # The products are selected by the tag, other products can share the
+        # directory
+        pattern = '*.tif' if scenes else '*-' + products[0]['tag'] + '-*.tif'
+        files = glob(pathInput + pattern)
+        if interval == 'season':
+            files += glob(pathInput.replace('/' + year + '/', '/' + previous + '/') + pattern)
+    if nc is None:
+        files.sort()
+
+    # The states of the scenes have all the accumulators to merge them later
+    if states and scenes:
+        accumulate = statistics + [s for s in STATE_STATISTICS if s not in statistics]
+    else:
+        accumulate = statistics
+
+    # Obtain the files (or scenes of the cube) from a same bin (hour, day,
+    # pentad, week, month, season or year)
+    filesDate = groupFiles(files, interval, dates, year)
+
+    # Profile of the products from the reference
+    profile = outputProfile(ref, compress, nodata)
+    selected = [date for date in filesDate if only is None or date in only]
+    options = {'rollup': rollup, 'states': states, 'memory': memory, 'profile': profile,
+               'depth': depth, 'ordered': ordered, 'compact': compact}
+
+    print('Processing files... ')
+    failed = []
+    if processes > 1:
+        cube = nc is not None
+        if cube:
+            nc.close()
+        # Each worker writes the products of its bins, the names depend only
+        # on the bin
+        jobs = [((interval, year, date, filesDate[date], products, accumulate), options, cube)
+                for date in selected]
+        with ProcessPoolExecutor(max_workers=processes, initializer=limitMemory,
+                                 initargs=(memoryLimit,)) as executor:
+            futures = {executor.submit(runBin, job): job[0][2] for job in jobs}
+            for future in as_completed(futures):
+                # A worker killed in C code breaks the pool, its bin and the
+                # bins still pending fail but the summary is printed
+                try:
+                    date, error = future.result()
+                except Exception as e:
+                    date, error = futures[future], repr(e)
+                if error is not None:
+                    print('Error: ', interval, date, error)
+                    failed.append((date, error))
+        failed.sort()
+        print('Bins processed: ', len(selected) - len(failed), ' failed: ', len(failed))
+        for date, error in failed:
+            print(interval.capitalize() + ' failed: ', date, error)
+        if interval == 'day' and states:
+            done = {date for date, _ in failed}
+            seedManifest(year, {date: filesDate[date] for date in selected if date not in done}, names)
+        return failed
+
+    # The writer in background and the maps waiting to be rendered in parallel
+    writer = backgroundWriter()
+    pngs = [] if workers > 1 else None
+
+    # Loop over files from a same bin
+    for date in selected:
+        processBin(interval, year, date, filesDate[date], products, accumulate, nc=nc, dates=dates,
+                   pngs=pngs, writer=writer, **options)
+        if pngs is not None and len(pngs) >= 8 * workers:
+            renderBatch(pngs, workers)
+            pngs = []
+    if pngs:
+        renderBatch(pngs, workers)
+    flushWrites(writer, close=True)
+    if nc is not None:
+        nc.close()
+    if interval == 'day' and states:
+        seedManifest(year, {date: filesDate[date] for date in selected}, names)
+    return failed
+
+def manifestPath(year):
+    return pathState + 'manifest_' + year + '.json'
+
+def loadManifest(year):
+    # Manifest of the scenes folded in the state of each day
+    path = manifestPath(year)
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {'day': {}}
+
+def saveManifest(manifest, year):
+    # Write a temporary file and replace, the manifest is never left broken
+    path = manifestPath(year)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+def seedManifest(year, filesDate, names=None):
+    # Save in the manifest the scenes of the days whose state was saved by
+    # main, so update() only folds the scenes that came after
+    # names: names of the scenes of the cube, the files are its indices
+    manifest = loadManifest(year)
+    for date, files in filesDate.items():
+        if names is not None:
+            manifest['day'][date] = [str(names[i]) for i in files]
+        else:
+            manifest['day'][date] = [os.path.basename(file) for file in files]
+    saveManifest(manifest, year)
+
+def update(year, products, pathInput=None, compact=False):
+    # Fold only the new scenes in the states of the days, and save again only
+    # the affected days, months and year
+    # compact: the new states of integer scenes are compact
+    products = obtainProducts(products)
+    statistics = [product['statistic'] for product in products]
+    accumulate = statistics + [s for s in STATE_STATISTICS if s not in statistics]
+    if pathInput is None:
+        pathInput = pathData + 'geotiff/' + year + '/'
+
+    # List all files in the input directory
+    files = glob(pathInput + '*.tif')
+    files.sort()
+
+    # Scenes that are not in the manifest
+    manifest = loadManifest(year)
+    folded = set()
+    for names in manifest['day'].values():
+        folded.update(names)
+    new = [file for file in files if os.path.basename(file) not in folded]
+    if len(new) == 0:
+        print('There are no new scenes for ' + year)
+        return []
+    print('New scenes: ', len(new))
+
+    filesDate = groupFiles(new, 'day')
+    profile = outputProfile(ref)
+    allDays = None
+    for date in filesDate:
+        print('Day: ', date)
+        path = statePath('day', year, date)
+        if date in manifest['day'] and os.path.exists(path):
+            # Fold the new scenes in the previous state
+            state = loadState(path)
+            checkState(state, accumulate)
+            state = aggregate(filesDate[date], accumulate, True, state)
+            manifest['day'][date] += [os.path.basename(file) for file in filesDate[date]]
+        else:
+            # Without previous state all the scenes of the day are folded
+            if allDays is None:
+                allDays = groupFiles(files, 'day')
+            state = aggregate(allDays[date], accumulate, True, compact=compact)
+            manifest['day'][date] = [os.path.basename(file) for file in allDays[date]]
+        saveState(state, path)
+        saveProducts(state, products, 'day', year, date, profile)
+        saveManifest(manifest, year)
+
+    # Months affected by the new scenes
+    months = sorted({datetime.datetime.strptime(year + date, '%Y%j').strftime('%m') for date in filesDate})
+    main('month', year, products, only=months)
+    main('year', year, products)
+    return list(filesDate)
+
+if __name__ == "__main__":
+    years = ['2018', '2019', '2020', '2021', '2022', '2023']
+    for year in years:
+        # All the products of the day are obtained reading the scenes once
+        main('day', year, ['avr', 'max', 'tmax', 'min', 'std', 'count'])
+        # The month and year are obtained merging the states of the days
+        for interval in ['month', 'year']:
+            main(interval, year, ['avr', 'max', 'tmax', 'min', 'std', 'count'])
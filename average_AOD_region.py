@@ -11,8 +11,10 @@ import numpy as np
 from netCDF4 import Dataset
 import matplotlib.pyplot as plt
 import datetime
-import geopandas as gpd
 import rasterio
+from clip_AOD import regionBounds, refSize, sourceWindow, clipScene, processScenes
+from regrid_AOD import obtainIndexGrid, refProfile, regridNetCDF
+from read_AOD import fixedGrid
 #import pyproj
 #from osgeo import gdal, osr
 
@@ -34,69 +36,73 @@ def createTif(npy, pathRef, pathOutput, filename):
     dtype=npy.dtype, crs=crs, transform=transform) as dst:
         dst.write(npy, 1)
 
-# Region to cut
-# Open the file region with geopandas
-region = gpd.read_file(pathRegion)
-# Reproject to UTM 14N
-region = region.to_crs('EPSG:32614')
-# Obtain the bounding box
-bbox = region.total_bounds
-# Reproject to UTM
-print('Bounding box: ', bbox)
-# Define the variable to process
-var = 'AOD'
-
-# List all files in the input directory
-files = glob(pathInput + '*.nc')
-files.sort()
-
-# Loop over all files
-print('Processing files... ')
-for file in files:    
-    #print("Processing file: ", file)
-    # Obtain the date from the file name from this format "s20203632156180"
-    date = file.split('/')[-1].split('_')[3]
-    date = date[:-2]
-    date = datetime.datetime.strptime(date, 's%Y%j%H%M%S')
-
-    # Filter date to range  12:00 - 24:00 
-    if date.hour < 12:
-        continue
+def main(method='nearest', workers=1, quality='all'):
+    # method: 'warp' to use gdalwarp, 'nearest' or 'bilinear' to use the index
+    # quality: DQF of the pixels to keep, 'high', 'medium', 'low' or 'all' (only
+    # with the index)
+    # Both methods write float32 AOD (scale, offset and fill applied), so the
+    # scenes of the two methods can be aggregated together
+    # workers: number of processes to cut the files in parallel
+    # Obtain the size of the reference grid
+    size = refSize(pathRef)
+    # Define the variable to process
+    var = 'AOD'
+    if method == 'warp' and quality != 'all':
+        raise ValueError('The quality filter needs the index, not the method warp')
+
+    # List all files in the input directory
+    files = glob(pathInput + '*.nc')
+    files.sort()
+
+    # Select the files to process
+    selected = []
+    for file in files:
+        #print("Processing file: ", file)
+        # Obtain the date from the file name from this format "s20203632156180"
+        date = file.split('/')[-1].split('_')[3]
+        date = date[:-2]
+        date = datetime.datetime.strptime(date, 's%Y%j%H%M%S')
+
+        # Filter date to range  12:00 - 24:00
+        if date.hour < 12:
+            continue
+        else:
+            print("Date: ", date)
+            selected.append(file)
+    if len(selected) == 0:
+        print('No files to process')
+        return []
+
+    # The index of pixels or the window of the source are obtained once with
+    # the first file and shared by all the workers
+    if method != 'warp':
+        index = obtainIndexGrid(fixedGrid(selected[0]), pathRef, method)
+        profile = refProfile(pathRef)
     else:
-        print("Date: ", date)
-        
-        # Obtain name 
+        # Region to cut, only gdalwarp needs the bounding box of the region in
+        # UTM 14N (the index and the zones use the reference grid)
+        bbox = regionBounds(pathRegion, 'EPSG:32614')
+        print('Bounding box: ', bbox)
+        srcWin = sourceWindow(selected[0], bbox, var=var)
+
+    jobs = []
+    for file in selected:
+        # Obtain name
         name = file.split('/')[-1].split('.')[0]+'.tif'
-
-        # Open the file
-        #nc = Dataset(file, 'r')
-        # Read the AOD variable
-        #aod = nc.variables['AOD'][:].data
-        # Obtain the fill value
-        #fill_value = nc.variables['AOD']._FillValue
-        # Change the fill value to NaN
-        #aod[aod == fill_value] = np.nan
-        # Obtain the scale factor and offset
-        #scale_factor = nc.variables['AOD'].scale_factor
-        #add_offset = nc.variables['AOD'].add_offset
-        # Apply the scale factor and offset
-        #aod = aod * scale_factor + add_offset
-
-        # Convert the NetCDF to geotiff with GDAL
-        os.system('gdal_translate -of GTiff NETCDF:"'+file+'":'+var+' '+pathTmp+'AOD.tif')
-
-        # Convert the NetCDF to geotiff with rasterio
-        #createTif(aod, pathRef, pathTmp, 'AOD.tif')
-
-        # Reproyect to EPSG:32614
-        os.system('gdalwarp -t_srs EPSG:32614 '+pathTmp+'AOD.tif '+pathTmp+'AOD_32614.tif')
-
-        # Cut the region with gdalwarp
-        os.system('gdalwarp -te '+str(bbox[0])+' '+str(bbox[1])+' '+str(bbox[2])+' '+str(bbox[3])+' '+pathTmp+'AOD_32614.tif '+pathOutput+name)
-
-
-
-
-
-
-
+        if method != 'warp':
+            # Read the AOD of the NetCDF (scale, offset, fill and DQF applied) and
+            # regrid to the reference grid with the precomputed index
+            jobs.append((regridNetCDF, (file, index, pathOutput + name, profile),
+                         {'var': var, 'quality': quality}))
+        else:
+            # Open the variable of the NetCDF, reproyect to EPSG:32614 and cut
+            # the region in a single pass
+            jobs.append((clipScene, (file, bbox, pathOutput + name),
+                         {'var': var, 'size': size, 'srcWin': srcWin, 'unscale': True}))
+
+    # Loop over all files
+    print('Processing files... ')
+    return processScenes(jobs, workers)
+
+if __name__ == "__main__":
+    main()
@@ -11,8 +11,9 @@ import numpy as np
 from netCDF4 import Dataset
 import matplotlib.pyplot as plt
 import datetime
-import geopandas as gpd
 import rasterio
+from clip_AOD import regionBounds, refSize, sourceWindow, clipScene, processScenes
+from regrid_AOD import obtainIndex, refProfile, regridScene
 #import pyproj
 #from osgeo import gdal, osr
 
@@ -34,80 +35,69 @@ def createTif(npy, pathRef, pathOutput, filename):
     dtype=npy.dtype, crs=crs, transform=transform) as dst:
         dst.write(npy, 1)
 
-# Region to cut
-# Open the file region with geopandas
-region = gpd.read_file(pathRegion)
-# Reproject to UTM 14N
-region = region.to_crs('EPSG:32614')
-# Obtain the bounding box
-bbox = region.total_bounds
-# Reproject to UTM
-print('Bounding box: ', bbox)
-# Define the variable to process
-var = 'AOD'
-
-# List all files in the input directory
-dirFiles = glob(pathInput + '*')
-
-for dirFile in dirFiles:
-    print("Processing directory: ", dirFile)
-    files = glob(dirFile + '/*.tif')
-    files.sort()
+def main(method='nearest', workers=1):
+    # method: 'warp' to use gdalwarp, 'nearest' or 'bilinear' to use the index
+    # workers: number of processes to cut the files in parallel
+    # Region to cut
+    # Obtain the bounding box of the region in UTM 14N
+    bbox = regionBounds(pathRegion, 'EPSG:32614')
+    print('Bounding box: ', bbox)
+    # Obtain the size of the reference grid
+    size = refSize(pathRef)
+
+    # List all files in the input directory
+    dirFiles = glob(pathInput + '*')
+
+    # Select the files to process
+    selected = []
+    for dirFile in dirFiles:
+        print("Processing directory: ", dirFile)
+        files = glob(dirFile + '/*.tif')
+        files.sort()
+
+        for file in files:
+            #print("Processing file: ", file)
+            # Obtain the date from the file name from this format "s20233632156180"
+            date = file.split('/')[-1].split('_')[4]
+            date = datetime.datetime.strptime(date, 's%Y%m%d')
+            time = file.split('/')[-1].split('_')[7]
+            time = datetime.datetime.strptime(time, '%H%MUTC')
+            # Add the time to the date
+            date = date.replace(hour=time.hour, minute=time.minute)
+
+            # Filter date to range  12:00 - 24:00
+            if time.hour < 12:
+                continue
+            else:
+                print("Date: ", date)
+                selected.append(file)
+    if len(selected) == 0:
+        print('No files to process')
+        return []
+
+    # The index of pixels or the window of the source are obtained once with
+    # the first file and shared by all the workers
+    if method != 'warp':
+        index = obtainIndex(selected[0], pathRef, method)
+        profile = refProfile(pathRef)
+    else:
+        srcWin = sourceWindow(selected[0], bbox)
+
+    jobs = []
+    for file in selected:
+        # Obtain name
+        name = file.split('/')[-1].split('.')[0]+'.tif'
+        if method != 'warp':
+            # Regrid to the reference grid with the precomputed index
+            jobs.append((regridScene, (file, index, pathOutput + name, profile), {}))
+        else:
+            # Reproyect to EPSG:32614 and cut the region in a single pass
+            jobs.append((clipScene, (file, bbox, pathOutput + name),
+                         {'size': size, 'srcWin': srcWin}))
 
     # Loop over all files
     print('Processing files... ')
-    for file in files:    
-        #print("Processing file: ", file)
-        # Obtain the date from the file name from this format "s20233632156180"
-        date = file.split('/')[-1].split('_')[4]
-        date = datetime.datetime.strptime(date, 's%Y%m%d')
-        time = file.split('/')[-1].split('_')[7]
-        time = datetime.datetime.strptime(time, '%H%MUTC')
-        # Add the time to the date
-        date = date.replace(hour=time.hour, minute=time.minute)
-
-        # Filter date to range  12:00 - 24:00 
-        if time.hour < 12:
-            continue
-        else:
-            print("Date: ", date)
-            
-            # Obtain name 
-            name = file.split('/')[-1].split('.')[0]+'.tif'
-
-            # Open the file
-            #nc = Dataset(file, 'r')
-            # Read the AOD variable
-            #aod = nc.variables['AOD'][:].data
-            # Obtain the fill value
-            #fill_value = nc.variables['AOD']._FillValue
-            # Change the fill value to NaN
-            #aod[aod == fill_value] = np.nan
-            # Obtain the scale factor and offset
-            #scale_factor = nc.variables['AOD'].scale_factor
-            #add_offset = nc.variables['AOD'].add_offset
-            # Apply the scale factor and offset
-            #aod = aod * scale_factor + add_offset
-
-            # Convert the NetCDF to geotiff with GDAL
-            #os.system('gdal_translate -of GTiff NETCDF:"'+file+'":'+var+' '+pathTmp+'AOD.tif')
-
-            # Convert the NetCDF to geotiff with rasterio
-            #createTif(aod, pathRef, pathTmp, 'AOD.tif')
-
-            # Reproyect to EPSG:32614
-            os.system('gdalwarp -t_srs EPSG:32614 '+file+' '+pathTmp+'AOD_32614.tif')
-
-            # Cut the region with gdalwarp
-            os.system('gdalwarp -te '+str(bbox[0])+' '+str(bbox[1])+' '+str(bbox[2])+' '+str(bbox[3])+' '+pathTmp+'AOD_32614.tif '+pathOutput+name)
-
-            # Remove the temporary file
-            os.system('rm '+pathTmp+'AOD_32614.tif')
-            #os.system('rm '+pathTmp+'AOD.tif')
-
-
-
-
-
-
+    return processScenes(jobs, workers)
 
+if __name__ == "__main__":
+    main()
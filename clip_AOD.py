@@ -0,0 +1,165 @@
+'''
+Functions to reproject and cut a region from GOES-16 ABI AOD in a single pass,
+without temporary files. Optionally only the window of the source that covers
+the region (plus a margin) is read and warped. The scenes can be processed in
+parallel with a pool of processes, no scratch files are shared between them.
+
+@author: urielm
+@date: 2026-10-18
+'''
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import geopandas as gpd
+import rasterio
+from rasterio.warp import transform as warpTransform
+from osgeo import gdal
+
+gdal.UseExceptions()
+
+def regionBounds(pathRegion, crs='EPSG:32614'):
+    # Open the file region with geopandas
+    region = gpd.read_file(pathRegion)
+    # Reproject to the crs of the output
+    region = region.to_crs(crs)
+    # Obtain the bounding box (xmin, ymin, xmax, ymax)
+    return tuple(region.total_bounds)
+
+def refSize(pathRef):
+    # Obtain the number of rows and columns of the reference grid
+    with rasterio.open(pathRef) as src:
+        return src.height, src.width
+
+def openScene(file, var=None):
+    # The NetCDF files are opened as the subdataset of the variable
+    if var is not None:
+        return gdal.Open('NETCDF:"' + file + '":' + var)
+    return gdal.Open(file)
+
+def sourceWindow(file, bbox, var=None, crs='EPSG:32614', margin=8, density=21):
+    # Window of the source [xoff, yoff, xsize, ysize] that covers the bbox,
+    # computed once and reused for every scene of the same grid
+    src = openScene(file, var)
+    gt = src.GetGeoTransform()
+    nx = src.RasterXSize
+    ny = src.RasterYSize
+    wkt = src.GetProjectionRef()
+    src = None
+
+    # Points along the border of the bbox
+    xmin, ymin, xmax, ymax = bbox
+    t = np.linspace(0, 1, density)
+    xs = np.concatenate([xmin + t * (xmax - xmin), np.full(density, xmax),
+                         xmax - t * (xmax - xmin), np.full(density, xmin)])
+    ys = np.concatenate([np.full(density, ymin), ymin + t * (ymax - ymin),
+                         np.full(density, ymax), ymax - t * (ymax - ymin)])
+    # Transform to the crs of the source and to pixel coordinates
+    sx, sy = warpTransform(crs, wkt, xs, ys)
+    sx = np.asarray(sx, dtype=float)
+    sy = np.asarray(sy, dtype=float)
+    inv = gdal.InvGeoTransform(gt)
+    cols = inv[0] + sx * inv[1] + sy * inv[2]
+    rows = inv[3] + sx * inv[4] + sy * inv[5]
+    valid = np.isfinite(cols) & np.isfinite(rows)
+    if not valid.any():
+        raise ValueError('The region is out of the source ' + file)
+
+    # Add the margin and limit to the size of the source
+    x0 = max(int(np.floor(cols[valid].min())) - margin, 0)
+    y0 = max(int(np.floor(rows[valid].min())) - margin, 0)
+    x1 = min(int(np.ceil(cols[valid].max())) + margin, nx)
+    y1 = min(int(np.ceil(rows[valid].max())) + margin, ny)
+    return [x0, y0, x1 - x0, y1 - y0]
+
+def cropScene(src, srcWin):
+    # Virtual dataset with only the window of the source, nothing is read yet
+    return gdal.Translate('', src, format='VRT', srcWin=srcWin)
+
+def warpOptions(bbox, crs='EPSG:32614', size=None, resampleAlg='near'):
+    # Options of gdalwarp -t_srs crs -te xmin ymin xmax ymax
+    options = {'dstSRS': crs, 'outputBounds': tuple(bbox), 'resampleAlg': resampleAlg}
+    # Force the size of the reference grid (rows, columns)
+    if size is not None:
+        options['height'] = size[0]
+        options['width'] = size[1]
+    return options
+
+def warpScene(file, bbox, var=None, crs='EPSG:32614', size=None, resampleAlg='near', srcWin=None):
+    # Reproject and cut the region in memory, return the dataset
+    src = openScene(file, var)
+    if srcWin is not None:
+        src = cropScene(src, srcWin)
+    dst = gdal.Warp('', src, format='MEM', **warpOptions(bbox, crs, size, resampleAlg))
+    src = None
+    return dst
+
+def clipScene(file, bbox, output, var=None, crs='EPSG:32614', size=None, resampleAlg='near', srcWin=None,
+              unscale=False):
+    # Reproject and cut the region directly to the output geotiff
+    # unscale: write float32 with the scale factor and offset applied and NaN
+    # in the fill value, like the scenes regridded with the index
+    src = openScene(file, var)
+    if srcWin is not None:
+        src = cropScene(src, srcWin)
+    if not unscale:
+        dst = gdal.Warp(output, src, format='GTiff', **warpOptions(bbox, crs, size, resampleAlg))
+        dst.FlushCache()
+        dst = None
+        src = None
+        return output
+    band = src.GetRasterBand(1)
+    scale = band.GetScale() or 1.0
+    offset = band.GetOffset() or 0.0
+    options = warpOptions(bbox, crs, size, resampleAlg)
+    options.update({'outputType': gdal.GDT_Float32, 'srcNodata': band.GetNoDataValue(),
+                    'dstNodata': float('nan')})
+    dst = gdal.Warp('', src, format='MEM', **options)
+    out = dst.GetRasterBand(1)
+    out.WriteArray(out.ReadAsArray() * np.float32(scale) + np.float32(offset))
+    out.SetScale(1.0)
+    out.SetOffset(0.0)
+    gdal.Translate(output, dst, format='GTiff')
+    dst = None
+    src = None
+    return output
+
+def runScene(job):
+    # Run the function of a scene, the errors are returned instead of raised so
+    # one bad file does not stop the batch
+    func, args, kwargs = job
+    try:
+        func(*args, **kwargs)
+        return args[0], None
+    except Exception as e:
+        return args[0], repr(e)
+
+def reportScene(i, n, file, error, failed):
+    # Print the result of a scene, the errors are added to failed
+    if error is None:
+        print('[{}/{}] Processed: {}'.format(i + 1, n, file))
+    else:
+        print('[{}/{}] Error: {} {}'.format(i + 1, n, file, error))
+        failed.append((file, error))
+
+def processScenes(jobs, workers=1):
+    # jobs: list of (function, args, kwargs), the first argument is the file
+    n = len(jobs)
+    failed = []
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(runScene, job): job[1][0] for job in jobs}
+            # The results arrive as the scenes are finished
+            for i, future in enumerate(as_completed(futures)):
+                # A worker killed in C code breaks the pool, its scene and the
+                # scenes still pending fail but the batch is reported
+                try:
+                    file, error = future.result()
+                except Exception as e:
+                    file, error = futures[future], repr(e)
+                reportScene(i, n, file, error, failed)
+        failed.sort()
+    else:
+        for i, job in enumerate(jobs):
+            reportScene(i, n, *runScene(job), failed)
+    print('Processed files: ', n - len(failed), ' Failed files: ', len(failed))
+    return failed
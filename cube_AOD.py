@@ -0,0 +1,155 @@
+'''
+Datacube of the scenes of GOES-16 ABI AOD, one NetCDF4 compressed file per year
+with dimensions (time, y, x)
+
+The clipped scenes (GeoTIFF) are ingested once in the cube of the year, then the
+aggregation and the graphics open only one file instead of one file per scene.
+The chunks hold several scenes of a tile, so a map and a time series of a pixel
+read few chunks.
+
+@author: urielm
+@date: 2026-10-18
+'''
+
+from glob import glob
+import os
+import datetime
+import numpy as np
+import rasterio
+from rasterio.crs import CRS
+from rasterio.transform import Affine
+from netCDF4 import Dataset, num2date
+from group_AOD import parseDate
+from read_AOD import readGeoTIFF
+
+pathCube = '/data/tmp/AOD_average/cube/'
+
+# Units of the time of the scenes
+TIME_UNITS = 'seconds since 1970-01-01 00:00:00'
+
+def cubePath(year):
+    return pathCube + 'CG_ABI-L2-AODC-M6_G16_' + year + '.nc'
+
+def cubeChunks(shape, size=2**20, tile=256):
+    # Chunk (time, y, x) of about size bytes (float32), tiles of at most
+    # tile x tile pixels and the rest of the chunk in time
+    y = min(shape[0], tile)
+    x = min(shape[1], tile)
+    return (max(1, size // (4 * y * x)), y, x)
+
+def createCube(path, crs, transform, shape, chunks=None, complevel=4):
+    # Create the empty cube with the grid of the reference
+    if chunks is None:
+        chunks = cubeChunks(shape)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    nc = Dataset(path, 'w', format='NETCDF4')
+    nc.createDimension('time', None)
+    nc.createDimension('y', shape[0])
+    nc.createDimension('x', shape[1])
+    time = nc.createVariable('time', 'f8', ('time',))
+    time.units = TIME_UNITS
+    time.calendar = 'standard'
+    nc.createVariable('scene', str, ('time',))
+    # Coordinates of the center of the pixels
+    y = nc.createVariable('y', 'f8', ('y',))
+    x = nc.createVariable('x', 'f8', ('x',))
+    y[:] = transform.f + transform.e * (np.arange(shape[0]) + 0.5)
+    x[:] = transform.c + transform.a * (np.arange(shape[1]) + 0.5)
+    aod = nc.createVariable('AOD', 'f4', ('time', 'y', 'x'), zlib=True, complevel=complevel,
+                            shuffle=True, chunksizes=chunks, fill_value=np.float32(np.nan))
+    aod.long_name = 'Aerosol Optical Depth'
+    nc.crs_wkt = crs.to_wkt()
+    nc.geotransform = ' '.join(str(v) for v in transform.to_gdal())
+    return nc
+
+def openCube(year, mode='r'):
+    return Dataset(cubePath(year), mode)
+
+def cubeGeo(nc):
+    # Crs and transform of the cube
+    transform = Affine.from_gdal(*[float(v) for v in nc.geotransform.split()])
+    return CRS.from_wkt(nc.crs_wkt), transform
+
+def cubeDates(nc):
+    # Dates of the scenes of the cube
+    times = nc.variables['time'][:]
+    return [datetime.datetime(d.year, d.month, d.day, d.hour, d.minute, d.second)
+            for d in num2date(times, TIME_UNITS)]
+
+def ingest(files, year, fill_value=-32768.0, batch=None):
+    # Append to the cube of the year the scenes that are not in it, sorted by
+    # time, and return the number of scenes added
+    path = cubePath(year)
+    files = sorted(files, key=parseDate)
+    nc = None
+    try:
+        if os.path.exists(path):
+            nc = openCube(year, 'a')
+            names = set(nc.variables['scene'][:])
+        else:
+            names = set()
+        files = [file for file in files if os.path.basename(file) not in names]
+        if len(files) == 0:
+            return 0
+        if nc is None:
+            with rasterio.open(files[0]) as src:
+                nc = createCube(path, src.crs, src.transform, src.shape)
+        aod = nc.variables['AOD']
+        # The scenes are written by groups of the chunk in time
+        if batch is None:
+            batch = aod.chunking()[0]
+        n = aod.shape[0]
+        for i in range(0, len(files), batch):
+            block = []
+            for file in files[i:i + batch]:
+                print('Ingesting file: ', file)
+                # Decoded like the aggregation: scale, offset and nodata
+                block.append(readGeoTIFF(file, fill_value=fill_value))
+            j = n + i
+            aod[j:j + len(block)] = np.stack(block)
+            nc.variables['time'][j:j + len(block)] = [parseDate(file).replace(
+                tzinfo=datetime.timezone.utc).timestamp() for file in files[i:i + batch]]
+            for k, file in enumerate(files[i:i + batch]):
+                nc.variables['scene'][j + k] = os.path.basename(file)
+        return len(files)
+    finally:
+        if nc is not None:
+            nc.close()
+
+def readScenes(nc, indices, batch=None):
+    # Read the scenes of a list of indices by groups of the chunk in time,
+    # yield (index, aod)
+    aod = nc.variables['AOD']
+    aod.set_auto_mask(False)
+    if batch is None:
+        batch = aod.chunking()[0]
+    indices = sorted(indices)
+    for i in range(0, len(indices), batch):
+        group = indices[i:i + batch]
+        # The indices of a bin are usually consecutive
+        if group[-1] - group[0] == len(group) - 1:
+            block = aod[group[0]:group[-1] + 1]
+        else:
+            block = aod[group]
+        for index, data in zip(group, block):
+            yield index, data
+
+def timeSeries(nc, row, col, size=1):
+    # AOD of all the scenes in a pixel (or the mean of a window size x size)
+    aod = nc.variables['AOD']
+    aod.set_auto_mask(False)
+    half = size // 2
+    data = aod[:, max(row - half, 0):row + half + 1, max(col - half, 0):col + half + 1]
+    data = data.reshape(data.shape[0], -1)
+    valid = ~np.isnan(data)
+    count = valid.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(valid, data, 0).sum(axis=1) / count
+    mean[count == 0] = np.nan
+    return mean
+
+if __name__ == "__main__":
+    years = ['2018', '2019', '2020', '2021', '2022', '2023']
+    for year in years:
+        files = glob('/data/tmp/AOD_average/geotiff/' + year + '/*.tif')
+        print('Scenes added: ', ingest(files, year))
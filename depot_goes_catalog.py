@@ -0,0 +1,126 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Catálogo en SQLite de los archivos del GOES-16 almacenados en el servidor
+lustre (/depot/goes16), para consultar intervalos de tiempo sin recorrer los
+directorios.
+
+El catálogo se actualiza de forma incremental: sólo se vuelven a leer los
+directorios de semana cuya fecha de modificación cambió.
+
+@author: urielm
+"""
+
+import os
+import re
+import sqlite3
+import calendar
+from datetime import datetime
+
+DEPOT = "/depot/goes16"
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS archivos (
+    ruta TEXT PRIMARY KEY,
+    directorio TEXT,
+    sensor TEXT,
+    nivel TEXT,
+    dominio TEXT,
+    producto TEXT,
+    fecha INTEGER,
+    minutos INTEGER,
+    inicio INTEGER,
+    fin INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_archivos_inicio ON archivos (sensor, nivel, dominio, inicio);
+CREATE INDEX IF NOT EXISTS idx_archivos_fecha ON archivos (sensor, nivel, dominio, fecha);
+CREATE INDEX IF NOT EXISTS idx_archivos_directorio ON archivos (directorio);
+CREATE TABLE IF NOT EXISTS directorios (
+    ruta TEXT PRIMARY KEY,
+    mtime REAL
+);
+"""
+
+# OR_ABI-L2-AODC-M6_G16_s20191601801171_e20191601803544_c20191601805366.nc
+# El mismo patrón de inicio que depot_goes_files_dates, el fin es opcional
+PATRON = re.compile(r"s(\d{11})\d*(?:_e(\d{11}))?")
+
+def segundos(tiempo):
+    # Segundos desde 1970-01-01 UTC de un tiempo YYYYJJJHHMM
+    return calendar.timegm(datetime.strptime(tiempo, "%Y%j%H%M").timetuple())
+
+def catalogo_abre(ruta_db):
+    con = sqlite3.connect(ruta_db)
+    con.executescript(ESQUEMA)
+    return con
+
+def catalogo_registro(ruta, sensor, nivel, dominio):
+    nombre = os.path.basename(ruta)
+    r = PATRON.search(nombre)
+    # Los índices de los tar (.idx.json) no son archivos de datos
+    if not r or nombre.endswith(".idx.json"):
+        return None
+    s, e = r.groups()
+    # Sin tiempo de fin el archivo empieza y termina en el inicio
+    if e is None:
+        e = s
+    producto = re.sub(r"(_G\d{2})?_?$", "", nombre[:r.start()])
+    fecha = int(s[:7])
+    minutos = int(s[7:9])*60 + int(s[9:11])
+    return (ruta, os.path.dirname(ruta), sensor, nivel, dominio, producto,
+            fecha, minutos, segundos(s), segundos(e))
+
+def catalogo_actualiza(con, sensor, nivel, dominio, depot=DEPOT, forzar=False):
+    base = "{}/{}/{}/{}".format(depot, sensor, nivel, dominio)
+    if not os.path.isdir(base):
+        print("Error: No se puede abrir el directorio", base)
+        return 0
+    mtimes = dict(con.execute("SELECT ruta, mtime FROM directorios"))
+    nuevos = 0
+    # Directorios de año y de semana
+    for year in sorted(os.scandir(base), key=lambda e: e.name):
+        if not year.is_dir():
+            continue
+        for semana in sorted(os.scandir(year.path), key=lambda e: e.name):
+            if not semana.is_dir():
+                continue
+            mtime = semana.stat().st_mtime
+            if not forzar and mtimes.get(semana.path) == mtime:
+                continue
+            registros = []
+            with os.scandir(semana.path) as i:
+                for entry in i:
+                    if entry.is_file():
+                        registro = catalogo_registro(entry.path, sensor, nivel, dominio)
+                        if registro:
+                            registros.append(registro)
+            with con:
+                con.execute("DELETE FROM archivos WHERE directorio = ?", (semana.path,))
+                con.executemany("INSERT OR REPLACE INTO archivos VALUES (?,?,?,?,?,?,?,?,?,?)", registros)
+                con.execute("INSERT OR REPLACE INTO directorios VALUES (?,?)", (semana.path, mtime))
+            print(len(registros), "archivos en", semana.path)
+            nuevos += len(registros)
+    return nuevos
+
+def catalogo_consulta(con, sensor, nivel, dominio, inicio, fin, producto=None):
+    # Archivos con tiempo de inicio entre inicio y fin (datetime en UTC)
+    sql = ("SELECT ruta FROM archivos WHERE sensor = ? AND nivel = ? AND dominio = ? "
+           "AND inicio >= ? AND inicio <= ?")
+    args = [sensor, nivel, dominio,
+            calendar.timegm(inicio.timetuple()), calendar.timegm(fin.timetuple())]
+    if producto:
+        sql += " AND producto LIKE ?"
+        args.append("%" + producto + "%")
+    sql += " ORDER BY inicio"
+    return [r[0] for r in con.execute(sql, args)]
+
+def catalogo_fecha(con, sensor, nivel, dominio, fecha):
+    # Archivos de una fecha juliana YYYYJJJ, como depot_goes_files_date
+    sql = ("SELECT ruta FROM archivos WHERE sensor = ? AND nivel = ? AND dominio = ? "
+           "AND fecha = ? ORDER BY inicio")
+    return [r[0] for r in con.execute(sql, (sensor, nivel, dominio, fecha))]
+
+if __name__== "__main__":
+    con = catalogo_abre("/data/tmp/AOD_average/depot_goes16.sqlite")
+    catalogo_actualiza(con, "abi", "l2", "conus")
+    con.close()
@@ -14,8 +14,11 @@ lustre con base en intervalos de tiempo.
 import os
 import re
 import sys
+import json
 import tarfile
-from datetime import date
+from datetime import date, timedelta
+import numpy as np
+from depot_goes_catalog import catalogo_abre, catalogo_fecha
 
 
 def horastr2minutos(hora):
@@ -53,6 +56,22 @@ def fecha2juliandate(fecha):
 def juliandates_range(jdate1, jdate2, days_step):
     return list(range(jdate1, jdate2, days_step))
 
+def juliandate2date(jdate):
+    return date(jdate//1000, 1, 1) + timedelta(days=jdate % 1000 - 1)
+
+def date2juliandate(d):
+    return int("{}{:03d}".format(d.year, d.timetuple().tm_yday))
+
+def juliandates_between(jdate1, jdate2, days_step=1):
+    # Como juliandates_range pero incluye jdate2 y cruza el cambio de año
+    d = juliandate2date(jdate1)
+    fin = juliandate2date(jdate2)
+    jdates = []
+    while d <= fin:
+        jdates.append(date2juliandate(d))
+        d += timedelta(days=days_step)
+    return jdates
+
 def  hours_range(hora1, hora2, step):
      minslist = list(range(hora1, hora2+1, step))
      return minslist
@@ -87,6 +106,57 @@ def depot_goes_files_date(fecha, directorio):
         return None
     return files
 
+def depot_goes_week_path(fecha, directorio):
+    year = fecha//1000
+    jday = fecha % 1000
+    week = jday//7 + 1
+    return "{}/{}/{:02d}".format(directorio, year, week)
+
+def depot_goes_files_dates(fechas, directorio, minutes_intervals=None):
+    # Agrupa las fechas por directorio de semana, cada directorio se lee una
+    # sola vez y sus archivos se reparten por fecha
+    semanas = {}
+    for fecha in fechas:
+        semanas.setdefault(depot_goes_week_path(fecha, directorio), set()).add(fecha)
+    files = {fecha: [] for fecha in fechas}
+    for path in semanas:
+        if not os.path.isdir(path):
+            print("Error: No se puede abrir el directorio", path)
+            continue
+        with os.scandir(path) as i:
+            for entry in i:
+                # Los índices de tar de versiones anteriores no son datos
+                if not entry.is_file() or entry.name.endswith(INDICE_EXT):
+                    continue
+                r = re.search(r"s(\d{7})(\d{2})(\d{2})", entry.name)
+                if not r or int(r.group(1)) not in semanas[path]:
+                    continue
+                # Filtra por intervalos de minutos (m1, m2)
+                if minutes_intervals:
+                    m = int(r.group(2))*60 + int(r.group(3))
+                    if not any(m1 <= m and m <= m2 for m1, m2 in minutes_intervals):
+                        continue
+                files[int(r.group(1))].append(path + "/" + entry.name)
+    for fecha in files:
+        files[fecha].sort()
+    return files
+
+def depot_goes_plan(fecha1, fecha2, directorio, horas=None, days_step=1):
+    # Archivos por fecha entre fecha1 y fecha2 (YYYYJJJ o "YYYYMMDD", incluidas),
+    # horas es una lista opcional de intervalos "HH:MM-HH:MM"
+    if isinstance(fecha1, str) and len(fecha1)==8:
+        fecha1 = fecha2juliandate(fecha1)
+    if isinstance(fecha2, str) and len(fecha2)==8:
+        fecha2 = fecha2juliandate(fecha2)
+    minutes_intervals = None
+    if horas:
+        minutes_intervals = []
+        for t in horas:
+            h1, h2 = t.split('-')
+            minutes_intervals.append((horastr2minutos(h1), horastr2minutos(h2)))
+    fechas = juliandates_between(int(fecha1), int(fecha2), days_step)
+    return depot_goes_files_dates(fechas, directorio, minutes_intervals)
+
 def depot_get_minutes_from_filename(filename):
     r = re.search("s\d{7}(\d{2})(\d{2})", filename)
     if r:
@@ -95,7 +165,60 @@ def depot_get_minutes_from_filename(filename):
         return minutos
     return None
 
-def depot_goes_files_date_times(horas, fecha, directorio):    
+def minutos_base(fecha):
+    # Minutos desde 1970-01-01 al inicio de la fecha juliana YYYYJJJ
+    return (juliandate2date(fecha) - date(1970, 1, 1)).days * 1440
+
+def minutos_datetime(dt):
+    # Minutos desde 1970-01-01 de un datetime en UTC (p.ej. de una estación)
+    return (dt.date() - date(1970, 1, 1)).days * 1440 + dt.hour*60 + dt.minute
+
+def indice_tiempos(files):
+    # Índice de tiempos: minutos desde 1970 del inicio de cada archivo,
+    # ordenados, y los archivos en el mismo orden
+    tiempos = []
+    validos = []
+    for f in files:
+        r = re.search(r"s(\d{7})(\d{2})(\d{2})", os.path.basename(f))
+        if r and not f.endswith(INDICE_EXT):
+            fecha, h, m = r.groups()
+            tiempos.append(minutos_base(int(fecha)) + int(h)*60 + int(m))
+            validos.append(f)
+    tiempos = np.array(tiempos, dtype=np.int64)
+    orden = np.argsort(tiempos, kind="stable")
+    return {"tiempos": tiempos[orden], "files": [validos[i] for i in orden]}
+
+def indice_exactos(indice, tiempos):
+    # Archivos cuyo minuto de inicio está en tiempos
+    mask = np.isin(indice["tiempos"], np.asarray(tiempos, dtype=np.int64))
+    return [indice["files"][i] for i in np.flatnonzero(mask)]
+
+def indice_intervalos(indice, intervalos):
+    # Archivos con inicio en alguno de los intervalos [t1, t2] (búsqueda binaria)
+    intervalos = np.asarray(intervalos, dtype=np.int64).reshape(-1, 2)
+    i1 = np.searchsorted(indice["tiempos"], intervalos[:, 0], side="left")
+    i2 = np.searchsorted(indice["tiempos"], intervalos[:, 1], side="right")
+    mask = np.zeros(len(indice["files"]), dtype=bool)
+    for a, b in zip(i1, i2):
+        mask[a:b] = True
+    return mask
+
+def indice_cercanos(indice, tiempos, tolerancia=None):
+    # Posición del archivo más cercano a cada tiempo, -1 si está a más de
+    # tolerancia minutos (o si no hay archivos)
+    t = indice["tiempos"]
+    tiempos = np.asarray(tiempos, dtype=np.int64)
+    if len(t) == 0:
+        return np.full(tiempos.shape, -1, dtype=np.int64)
+    der = np.clip(np.searchsorted(t, tiempos), 0, len(t) - 1)
+    izq = np.clip(der - 1, 0, len(t) - 1)
+    # En empate se queda el anterior, como min() sobre la lista ordenada
+    pos = np.where(np.abs(t[izq] - tiempos) <= np.abs(t[der] - tiempos), izq, der)
+    if tolerancia is not None:
+        pos = np.where(np.abs(t[pos] - tiempos) <= tolerancia, pos, -1)
+    return pos
+
+def depot_goes_files_date_times(horas, fecha, directorio, tolerancia=None):    
     files = depot_goes_files_date(fecha, directorio)
     if not files or len(files) == 0:
         print("Aviso: No hay datos en la fecha", fecha)
@@ -103,29 +226,22 @@ def depot_goes_files_date_times(horas, fecha, directorio):
 
     mins_min = horas[0]
     mins_max = horas[-1]
-    
-    hfiles = []
-    minsf = []
-    for f in files:
-        r = re.search("s\d{7}(\d{2})(\d{2})", f)        
-        if r:
-            h, m = r.groups()
-            mf = int(h)*60 + int(m)
-            if mf >= mins_min and mf <= mins_max:
-                hfiles.append(f)
-                minsf.append(mf)
+    base = minutos_base(fecha)
+
+    indice = indice_tiempos(files)
+    mask = indice_intervalos(indice, [(base + mins_min, base + mins_max)])
+    hindice = {"tiempos": indice["tiempos"][mask],
+               "files": [f for f, ok in zip(indice["files"], mask) if ok]}
+    hfiles = hindice["files"]
 
     if len(hfiles) == 0:
         print("Aviso: No hay datos entre las horas", minutos2hora(mins_min), minutos2hora(mins_max))
         return None
     
     if len(horas) > 2:
-        hfiles2 = []
-        for m in horas:
-            mf = min(minsf, key=lambda x:abs(x-m))
-            i = minsf.index(mf)
-            hfiles2.append(hfiles[i])
-        hfiles = hfiles2
+        # El archivo más cercano a cada hora, todas a la vez
+        pos = indice_cercanos(hindice, [base + m for m in horas], tolerancia)
+        hfiles = [hfiles[i] for i in pos if i >= 0]
 
     return hfiles
 
@@ -136,22 +252,83 @@ def depot_goes_extract(datafile, destdir):
     print(file)
     return True
     
-def depot_goes_extract_products(datafile, products, destdir):
+# Directorio de los índices de los tar cuando no se puede escribir junto al tar
+INDICE_CACHE = "/data/tmp/AOD_average/tar_idx"
+INDICE_EXT = ".idx.json"
+
+def depot_goes_tar_indice_ruta(datafile, cache=None):
+    # Los índices se guardan siempre en el cache, nunca dentro de /depot
+    return os.path.join(cache or INDICE_CACHE, os.path.basename(datafile) + INDICE_EXT)
+
+def depot_goes_tar_indice(datafile, cache=None):
+    # Índice de los miembros del tar: nombre, posición de los datos y tamaño.
+    # Se construye una vez y se reutiliza mientras el tar no cambie
+    st = os.stat(datafile)
+    ruta = depot_goes_tar_indice_ruta(datafile, cache)
+    if os.path.exists(ruta):
+        with open(ruta) as f:
+            indice = json.load(f)
+        if indice["size"] == st.st_size and indice["mtime"] == st.st_mtime:
+            return indice
+    # Sólo en un tar sin compresión se puede leer directamente en la posición
+    try:
+        tar = tarfile.open(datafile, "r:")
+        comprimido = False
+    except tarfile.ReadError:
+        tar = tarfile.open(datafile, "r")
+        comprimido = True
+    miembros = [[m.name, m.offset_data, m.size] for m in tar if m.isfile()]
+    tar.close()
+    indice = {"size": st.st_size, "mtime": st.st_mtime, "comprimido": comprimido,
+              "miembros": miembros}
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    with open(ruta + ".tmp", "w") as f:
+        json.dump(indice, f)
+    os.replace(ruta + ".tmp", ruta)
+    return indice
+
+def depot_goes_tar_miembros(indice, products):
+    # Miembros del índice que corresponden a alguno de los productos
+    return [m for m in indice["miembros"] if any(re.search(p, m[0]) for p in products)]
+
+def depot_goes_tar_lee(datafile, miembro, indice):
+    # Bytes de un miembro del tar, leídos directamente en su posición
+    nombre, offset, size = miembro
+    if indice["comprimido"]:
+        with tarfile.open(datafile, "r") as tar:
+            return tar.extractfile(nombre).read()
+    with open(datafile, "rb") as f:
+        f.seek(offset)
+        return f.read(size)
+
+def depot_goes_extract_products(datafile, products, destdir, cache=None):
     try:
         count = 0
         print("Abriendo ", datafile)
-        tar = tarfile.open(datafile, "r")
-        for name in tar.getnames():
-            for p in products:
-                if re.search(p, name):
-                    tar.extract(name, destdir)
-                    count += 1                    
-        tar.close()
+        indice = depot_goes_tar_indice(datafile, cache)
+        miembros = depot_goes_tar_miembros(indice, products)
+        if indice["comprimido"]:
+            # Sin posiciones útiles, se extraen por nombre
+            with tarfile.open(datafile, "r") as tar:
+                for nombre, offset, size in miembros:
+                    tar.extract(nombre, destdir)
+                    count += 1
+        else:
+            with open(datafile, "rb") as f:
+                for nombre, offset, size in miembros:
+                    destino = os.path.normpath(os.path.join(destdir, nombre))
+                    if not destino.startswith(os.path.normpath(destdir) + os.sep):
+                        print("Aviso: Se ignora el miembro", nombre)
+                        continue
+                    os.makedirs(os.path.dirname(destino), exist_ok=True)
+                    f.seek(offset)
+                    with open(destino, "wb") as out:
+                        out.write(f.read(size))
+                    count += 1
         print(count, "archivos extraidos en", destdir)
         return True
-    except KeyError:
-        print("Error: {} no está en {}".format(filename, tarfilename))
-        tar.close()
+    except KeyError as e:
+        print("Error: {} no está en {}".format(e, datafile))
         return False
     except IOError:
         print("Error: No se pudo abrir", datafile)
@@ -164,7 +341,7 @@ def error(msg):
     print("Error: ", msg)
     exit(1)
     
-def recupera_datos(nivel, dominio, fechas, horas=None, sensor="abi"):
+def recupera_datos(nivel, dominio, fechas, horas=None, sensor="abi", catalogo=None):
     if sensor != "abi":
         error("Sensor no reconocido "+sensor)
     if nivel != "l1b" and nivel != "l2":
@@ -172,8 +349,12 @@ def recupera_datos(nivel, dominio, fechas, horas=None, sensor="abi"):
     if dominio != "fd" and dominio != "conus":
         error("Dominio no reconocido "+dominio)    
 
-    directorio = depot_goes_directory(sensor, nivel, dominio)
-    files = []
+    # Con catálogo (ruta del sqlite o conexión) no se recorren los directorios
+    if catalogo is not None:
+        con = catalogo_abre(catalogo) if isinstance(catalogo, str) else catalogo
+    else:
+        directorio = depot_goes_directory(sensor, nivel, dominio)
+    lista_fechas = []
     for fe in fechas:
         # Si está en formato YYYYMMDD convierte a juliano
         if  isinstance(fe, str) and len(fe)==8:
@@ -185,8 +366,17 @@ def recupera_datos(nivel, dominio, fechas, horas=None, sensor="abi"):
             fecha = fe
         else:
             error("Formato de fecha no reconocido: "+fe)            
-        lista = depot_goes_files_date(fecha, directorio)
-        files += lista
+        lista_fechas.append(fecha)
+
+    files = []
+    if catalogo is not None:
+        for fecha in lista_fechas:
+            files += catalogo_fecha(con, sensor, nivel, dominio, fecha)
+    else:
+        # Cada directorio de semana se lee una sola vez
+        por_fecha = depot_goes_files_dates(lista_fechas, directorio)
+        for fecha in lista_fechas:
+            files += por_fecha[fecha]
 
     minutes = []
     minutes_intervals = []
@@ -206,18 +396,18 @@ def recupera_datos(nivel, dominio, fechas, horas=None, sensor="abi"):
                 error("Formato de hora no reconocido: "+t)
             minutes.append(m)
         print("minutes", minutes, minutes_intervals)
-        # Filtra la lista de archivos
-        nfiles = []
-        for f in files:
-            m = depot_get_minutes_from_filename(f)
-            if m in minutes:
-                nfiles.append(f)
-            else:
-                for mint in minutes_intervals:
-                    if mint[0] <= m and m <= mint[1]:
-                        nfiles.append(f)
-        files = nfiles
-                
+        # Filtra la lista de archivos con el índice de tiempos, las horas e
+        # intervalos se aplican a cada fecha
+        indice = indice_tiempos(files)
+        bases = [minutos_base(fecha) for fecha in lista_fechas]
+        mask = np.isin(indice["tiempos"], [b + m for b in bases for m in minutes])
+        if minutes_intervals:
+            mask |= indice_intervalos(indice, [(b + m1, b + m2) for b in bases
+                                               for m1, m2 in minutes_intervals])
+        files = [indice["files"][i] for i in np.flatnonzero(mask)]
+
+    if catalogo is not None and isinstance(catalogo, str):
+        con.close()
     return files
         
 if __name__== "__main__":  
@@ -225,10 +415,11 @@ if __name__== "__main__":
     dominio = "conus"
 
     fecha1 = 2019160
-    fecha2 = 2019365
-    fechas = juliandates_range(fecha1, fecha2, 1)
+    fecha2 = 2019364
 
-    #fechas = juliandates_range(fecha2juliandate(fecha1), fecha2juliandate(fecha2), 1)
+    # Lee cada directorio de semana una sola vez para todo el intervalo
+    directorio = depot_goes_directory("abi", nivel, dominio)
+    fechas = depot_goes_plan(fecha1, fecha2, directorio)
 
     destdir = "/data/tmp/AOD_average/"
     products = [ 'AOD' ]
@@ -236,7 +427,7 @@ if __name__== "__main__":
         #fecha = key
         #horas = fechoras[key]
         print(fecha)
-        files = recupera_datos(nivel, dominio, [fecha])
+        files = fechas[fecha]
         print(files)
         for datafile in files:
             depot_goes_extract_products(datafile, products, destdir)
@@ -0,0 +1,99 @@
+'''
+Functions to group the files of GOES-16 ABI AOD by hour, day, pentad, week,
+month, season or year
+
+Each file name is parsed once and the files are grouped in a single pass.
+
+@author: urielm
+@date: 2026-10-18
+'''
+
+import os
+import datetime
+
+BINS = ['hour', 'day', 'pentad', 'week', 'month', 'season', 'year']
+
+SEASONS = {1: 'DJF', 2: 'DJF', 3: 'MAM', 4: 'MAM', 5: 'MAM', 6: 'JJA',
+           7: 'JJA', 8: 'JJA', 9: 'SON', 10: 'SON', 11: 'SON', 12: 'DJF'}
+
+def obtainDate(file):
+    # Scene, date and time of the file name "..._s20230101_..._1830UTC.tif"
+    parts = os.path.basename(file).split('_')
+    return datetime.datetime.strptime(parts[4] + parts[7].split('.')[0], 's%Y%m%d%H%MUTC')
+
+def obtainDateMonth(file):
+    # Product of a day, month or year
+    #CG_ABI-L2-AODC-avr-M6_G16_2023132.tif
+    #CG_ABI-L2-AODC-avr-M6_G16_202301.tif
+    #CG_ABI-L2-AODC-avr-M6_G16_2023.tif
+    date = os.path.basename(file).split('_')[3].split('.')[0]
+    if len(date) == 7:
+        return datetime.datetime.strptime(date, '%Y%j')
+    elif len(date) == 6:
+        return datetime.datetime.strptime(date, '%Y%m')
+    return datetime.datetime.strptime(date, '%Y')
+
+def parseDate(file):
+    # The scenes have 8 or more fields in the name, the products 4
+    if len(os.path.basename(file).split('_')) > 7:
+        return obtainDate(file)
+    return obtainDateMonth(file)
+
+def seasonYear(date):
+    # December is in the DJF of the next year
+    return date.year + 1 if date.month == 12 else date.year
+
+def binKey(date, bin, year=None):
+    # Key of the bin, used in the name of the outputs
+    # year: year of the bins, the files of other years have no bin (None)
+    if bin == 'hour':
+        return date.strftime('%j%H')
+    elif bin == 'day':
+        return date.strftime('%j')
+    elif bin == 'pentad':
+        return 'P{:02d}'.format((date.timetuple().tm_yday - 1) // 5 + 1)
+    elif bin == 'week':
+        # ISO week, the first days of January in the last week of the previous
+        # year are W00 and the last days of December in the first week of the
+        # next year are W53, so a week never mixes two years
+        isoYear, week = date.isocalendar()[0:2]
+        if isoYear < date.year:
+            week = 0
+        elif isoYear > date.year:
+            week = 53
+        return 'W{:02d}'.format(week)
+    elif bin == 'month':
+        return date.strftime('%m')
+    elif bin == 'season':
+        # With the year, the DJF is December of the previous year, January and
+        # February. Without it, the DJF of a year is its January, February and
+        # December
+        if year is not None and seasonYear(date) != int(year):
+            return None
+        return SEASONS[date.month]
+    elif bin == 'year':
+        return date.strftime('%Y')
+    raise ValueError('Bin not recognized: ' + bin)
+
+def groupFiles(files, bin, dates=None, year=None):
+    # Group the files (sorted by date) in a single pass, return a dictionary
+    # {key: [files]} in the order of the files, the files without bin (key
+    # None) are skipped
+    if dates is None:
+        dates = [parseDate(file) for file in files]
+    print('Obtaining sublists of files from a same ' + bin + '... ')
+    groups = {}
+    for file, date in zip(files, dates):
+        key = binKey(date, bin, year)
+        if key is not None:
+            groups.setdefault(key, []).append(file)
+    for key in groups:
+        print(bin.capitalize() + ': ', key)
+        print('Number of files: ', len(groups[key]))
+    return groups
+
+def filesDays(files):
+    return groupFiles(files, 'day')
+
+def filesMonths(files):
+    return groupFiles(files, 'month')
@@ -0,0 +1,68 @@
+'''
+Functions to write the products of GOES-16 ABI AOD as Cloud-Optimized GeoTIFF
+
+The profile of the reference (ref_AOD.tif) is read once, the products are
+written as float32 compressed COG. The writes can be done by a thread in the
+background, so the next bin is accumulated while the previous one is written.
+
+@author: urielm
+@date: 2026-10-18
+'''
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import numpy as np
+import rasterio
+from regrid_AOD import refProfile
+
+@lru_cache(maxsize=None)
+def cachedProfile(pathRef):
+    # The reference is opened only once
+    return refProfile(pathRef)
+
+def outputProfile(pathRef, compress='deflate', nodata=np.nan, driver='COG'):
+    # Profile of the products: float32, compressed, tiles of 512 and the
+    # nodata selected (NaN by default)
+    profile = dict(cachedProfile(pathRef))
+    profile.update({'driver': driver, 'dtype': 'float32', 'nodata': nodata, 'compress': compress})
+    if compress in ('deflate', 'lzw', 'zstd'):
+        # Floating point predictor
+        profile['predictor'] = 3 if driver == 'GTiff' else 'YES'
+    if driver == 'COG':
+        profile['blocksize'] = 512
+    else:
+        profile.update({'tiled': True, 'blockxsize': 256, 'blockysize': 256})
+    return profile
+
+def prepareData(aod, profile):
+    # Convert to float32 and change NaN to the nodata
+    data = aod.astype(np.float32)
+    nodata = profile.get('nodata')
+    if nodata is not None and not np.isnan(nodata):
+        data[np.isnan(data)] = nodata
+    return data
+
+def writeProduct(aod, filename, profile):
+    with rasterio.open(filename, 'w', **profile) as dst:
+        dst.write(prepareData(aod, profile), 1)
+    return filename
+
+def backgroundWriter():
+    # One thread writes the products in order
+    return ThreadPoolExecutor(max_workers=1), deque()
+
+def submitWrite(writer, aod, filename, profile, limit=16):
+    # Queue a write, at most limit products wait in memory
+    executor, pending = writer
+    while len(pending) >= limit:
+        pending.popleft().result()
+    pending.append(executor.submit(writeProduct, aod, filename, profile))
+
+def flushWrites(writer, close=False):
+    # Wait for all the writes, the errors of the writes are raised here
+    executor, pending = writer
+    while pending:
+        pending.popleft().result()
+    if close:
+        executor.shutdown()
@@ -0,0 +1,134 @@
+'''
+Functions to read the AOD of the GOES-16 ABI L2 NetCDF, from a file or from
+memory, with the scale factor, offset and fill value applied and the pixels
+filtered by the quality flags (DQF)
+
+Only the variables AOD and DQF are read, and only the window of the region.
+
+The GeoTIFF of the scenes and products are read with rasterio and decoded in
+the same way, with the scale, offset and nodata of the band.
+
+@author: urielm
+@date: 2026-10-18
+'''
+
+import numpy as np
+import rasterio
+from netCDF4 import Dataset
+from rasterio.transform import Affine
+
+# Maximum DQF of each quality level of the AOD (0: high, 1: medium, 2: low,
+# 3: no retrieval), 'all' does not read the DQF
+QUALITY = {'high': 0, 'medium': 1, 'low': 2, 'all': None}
+
+def openNetCDF(file=None, data=None):
+    # Open the NetCDF from a file or from the bytes in memory
+    if data is not None:
+        return Dataset('inmemory.nc', memory=data)
+    return Dataset(file, 'r')
+
+def readRaw(variable, window=None):
+    # Read the values without mask and scale (the whole variable or a window
+    # (row_off, col_off, height, width))
+    variable.set_auto_maskandscale(False)
+    if window is None:
+        raw = np.asarray(variable[:])
+    else:
+        r0, c0, h, w = [int(v) for v in window]
+        raw = np.asarray(variable[r0:r0 + h, c0:c0 + w])
+    fill_value = getattr(variable, '_FillValue', None)
+    # The variables with _Unsigned are saved as signed integers
+    if str(getattr(variable, '_Unsigned', 'false')).lower() == 'true' and raw.dtype.kind == 'i':
+        utype = raw.dtype.str.replace('i', 'u')
+        raw = raw.view(utype)
+        if fill_value is not None:
+            fill_value = np.array(fill_value, dtype=raw.dtype.str.replace('u', 'i')).view(utype)
+    return raw, fill_value
+
+def decode(raw, fill_value, scale_factor, add_offset):
+    # Apply the scale factor and offset, change the fill value to NaN
+    aod = raw.astype(np.float32) * np.float32(scale_factor) + np.float32(add_offset)
+    if fill_value is not None:
+        aod[raw == fill_value] = np.nan
+    return aod
+
+def qualityMask(dqf, dqf_fill, quality):
+    # Pixels with the quality requested
+    valid = dqf <= QUALITY[quality]
+    if dqf_fill is not None:
+        valid &= dqf != dqf_fill
+    return valid
+
+def readAODRaw(file=None, data=None, var='AOD', quality='all', window=None):
+    # Raw values of the AOD without decoding: (raw, fill_value, scale_factor,
+    # add_offset, dqf), dqf is None if the quality is 'all'
+    if quality not in QUALITY:
+        raise ValueError('Quality not recognized: ' + quality)
+    dqf = None
+    # Open the file
+    nc = openNetCDF(file, data)
+    try:
+        variable = nc.variables[var]
+        # Read the AOD variable
+        raw, fill_value = readRaw(variable, window)
+        # Obtain the scale factor and offset
+        scale_factor = getattr(variable, 'scale_factor', 1.0)
+        add_offset = getattr(variable, 'add_offset', 0.0)
+        # Read the quality flags
+        if QUALITY[quality] is not None:
+            dqf, dqf_fill = readRaw(nc.variables['DQF'], window)
+            # The fill value of the DQF is excluded with the maximum DQF
+            if dqf_fill is not None:
+                dqf = np.where(dqf == dqf_fill, np.iinfo(np.uint8).max, dqf).astype(np.uint8)
+    finally:
+        nc.close()
+    return raw, fill_value, scale_factor, add_offset, dqf
+
+def readAOD(file=None, data=None, var='AOD', quality='all', window=None):
+    # quality: 'high', 'medium', 'low' or 'all'
+    # window: (row_off, col_off, height, width) of the region, None for all
+    raw, fill_value, scale_factor, add_offset, dqf = readAODRaw(file, data, var, quality, window)
+    aod = decode(raw, fill_value, scale_factor, add_offset)
+    if dqf is not None:
+        # The fill value of the DQF is already the maximum DQF
+        aod[~qualityMask(dqf, None, quality)] = np.nan
+    return aod
+
+def fileFill(nodata, fill_value, scenes):
+    # Value ignored in a file: the nodata of the file (the products written
+    # with a nodata that is not NaN), or the fill value of the scenes
+    if nodata is not None and not np.isnan(nodata):
+        return nodata
+    return fill_value if scenes else None
+
+def readFile(file, window=None):
+    # Open the file geotiff with rasterio, return the band and its scale,
+    # offset (the scenes cut with gdalwarp keep the raw integers) and nodata
+    with rasterio.open(file) as src:
+        return src.read(1, window=window), {'scale': src.scales[0], 'offset': src.offsets[0],
+                                            'nodata': src.nodata}
+
+def readGeoTIFF(file, window=None, fill_value=-32768.0, scenes=True):
+    # AOD (float32) of a GeoTIFF of a scene or a product, the ignored value is
+    # NaN and the scale and offset are applied
+    raw, info = readFile(file, window)
+    return decode(raw, fileFill(info['nodata'], fill_value, scenes), info['scale'], info['offset'])
+
+def fixedGrid(file=None, data=None):
+    # Crs, transform and shape of the fixed grid of the GOES from the NetCDF
+    nc = openNetCDF(file, data)
+    try:
+        proj = nc.variables['goes_imager_projection']
+        h = float(proj.perspective_point_height)
+        # x and y are the scan angles in radians
+        x = np.asarray(nc.variables['x'][:], dtype=float) * h
+        y = np.asarray(nc.variables['y'][:], dtype=float) * h
+        crs = '+proj=geos +h={} +lon_0={} +sweep={} +a={} +b={} +units=m +no_defs'.format(
+            h, float(proj.longitude_of_projection_origin), proj.sweep_angle_axis,
+            float(proj.semi_major_axis), float(proj.semi_minor_axis))
+    finally:
+        nc.close()
+    dx = (x[-1] - x[0]) / (len(x) - 1)
+    dy = (y[-1] - y[0]) / (len(y) - 1)
+    transform = Affine(dx, 0, x[0] - dx / 2, 0, dy, y[0] - dy / 2)
+    return crs, transform, (len(y), len(x))
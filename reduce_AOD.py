@@ -0,0 +1,375 @@
+'''
+Functions to accumulate statistics of GOES-16 ABI AOD pixel by pixel
+
+The state of the accumulation is a dictionary of arrays (sum, count, max, min,
+sum of squares, first and last valid time), each scene is read once and updates
+all the accumulators needed by the requested statistics. The states can be saved
+and merged, so the month and year are obtained exactly from the states of the
+days. updateRaw goes from the raw values (and DQF) of a scene to the
+accumulators without intermediate arrays, compiled with numba if it is
+installed.
+
+In the compact states (createState with the raw type) the sums are integers of
+the raw values and the counts uint16, the scale and offset are saved in the
+state and applied only in finalizeState. The sums are exact and do not depend
+on the order of the scenes.
+
+@author: urielm
+@date: 2026-10-18
+'''
+
+import os
+import datetime
+import numpy as np
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+# Accumulators needed by each statistic
+STATISTICS = {
+    'mean': ['sum', 'count'],
+    'max': ['max'],
+    'min': ['min'],
+    'count': ['count'],
+    'std': ['sum', 'sumsq', 'count'],
+    'tmax': ['max', 'tmax'],
+    'first': ['first'],
+    'last': ['last'],
+}
+
+# Statistics that are times
+TIMES = ('tmax', 'first', 'last')
+
+# Order of the accumulators in the fused kernel
+KERNEL = ('sum', 'sumsq', 'count', 'max', 'tmax', 'min', 'first', 'last')
+
+# Bytes by pixel of the temporary arrays of updateRawNumpy (valid, values,
+# new, the squares of the compact sums and the mask of NaN)
+SCRATCH_BYTES = 8 + 8 + 1 + 1 + 2
+
+def timestamp(date):
+    # Seconds since 1970-01-01 UTC of the date of a file
+    return date.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+def accumulators(statistics):
+    # Accumulators needed by a list of statistics
+    names = []
+    for statistic in statistics:
+        if statistic not in STATISTICS:
+            raise ValueError('Statistic not recognized: ' + statistic)
+        for name in STATISTICS[statistic]:
+            if name not in names:
+                names.append(name)
+    return names
+
+def sumType(rawType):
+    # The sum of 65535 values of 16 bits signed fits in int32
+    rawType = np.dtype(rawType)
+    if rawType.kind == 'i' and rawType.itemsize <= 2 or rawType.kind == 'u' and rawType.itemsize == 1:
+        return np.int32
+    return np.int64
+
+def createState(shape, statistics, rawType=None, scale=1.0, offset=0.0):
+    # Create the arrays of the accumulators
+    # rawType: integer type of the raw values for a compact state, the
+    # accumulators are in raw units until finalizeState
+    compact = rawType is not None
+    if compact and np.dtype(rawType).kind not in 'iu':
+        raise ValueError('The compact state needs raw values of integer type')
+    state = {}
+    for name in accumulators(statistics):
+        if name == 'sum':
+            state[name] = np.zeros(shape, dtype=sumType(rawType) if compact else np.float64)
+        elif name == 'sumsq':
+            state[name] = np.zeros(shape, dtype=np.int64 if compact else np.float64)
+        elif name == 'count':
+            state[name] = np.zeros(shape, dtype=np.uint16 if compact else np.uint32)
+        elif name in ('max', 'min') and compact:
+            # The raw values of 16 bits are exact in float32
+            state[name] = np.full(shape, np.nan, dtype=np.float32)
+        else:
+            state[name] = np.full(shape, np.nan)
+    if compact:
+        state['scale'] = np.array(scale, dtype=np.float64)
+        state['offset'] = np.array(offset, dtype=np.float64)
+    return state
+
+def isCompact(state):
+    return 'scale' in state
+
+def updateState(state, aod, t=None):
+    # Valid pixels of the scene
+    valid = ~np.isnan(aod)
+    # If the pixel is not NaN, sum 1 to the number of pixels
+    if 'count' in state:
+        state['count'] += valid
+    # Sum the AOD values if the pixel is not NaN
+    if 'sum' in state:
+        values = np.where(valid, aod, 0)
+        state['sum'] += values
+        if 'sumsq' in state:
+            state['sumsq'] += values * values
+    # Pixels where the scene is a new maximum (or the first valid value)
+    if 'max' in state:
+        new = valid & ~(aod <= state['max'])
+        state['max'][new] = aod[new]
+        if 'tmax' in state:
+            state['tmax'][new] = t
+    # Pixels where the scene is a new minimum
+    if 'min' in state:
+        new = valid & ~(aod >= state['min'])
+        state['min'][new] = aod[new]
+    # First and last time with a valid value
+    if 'first' in state:
+        np.fmin(state['first'], t, out=state['first'], where=valid)
+    if 'last' in state:
+        np.fmax(state['last'], t, out=state['last'], where=valid)
+
+def fusedKernel(raw, dqf, useDqf, maxDqf, fill, useFill, scale, offset, t,
+                sums, sumsq, count, vmax, tmax, vmin, first, last, flags):
+    # Decode, mask and accumulate pixel by pixel (the arrays are flat)
+    for i in range(raw.size):
+        r = raw[i]
+        if useFill and r == fill:
+            continue
+        if useDqf and dqf[i] > maxDqf:
+            continue
+        v = r * scale + offset
+        if v != v:
+            continue
+        if flags[0]:
+            sums[i] += v
+        if flags[1]:
+            sumsq[i] += v * v
+        if flags[2]:
+            count[i] += 1
+        if flags[3] and not (v <= vmax[i]):
+            vmax[i] = v
+            if flags[4]:
+                tmax[i] = t
+        if flags[5] and not (v >= vmin[i]):
+            vmin[i] = v
+        if flags[6] and not (t >= first[i]):
+            first[i] = t
+        if flags[7] and not (t <= last[i]):
+            last[i] = t
+
+if njit is not None:
+    fusedKernel = njit(cache=True, nogil=True)(fusedKernel)
+
+def updateRawNumpy(state, raw, fill_value, scale, offset, dqf, maxDqf, t, compact=False):
+    # The same as fusedKernel with numpy, only three temporary arrays
+    if fill_value is not None:
+        valid = raw != fill_value
+    else:
+        valid = np.ones(raw.shape, dtype=bool)
+    if dqf is not None:
+        valid &= dqf <= maxDqf
+    values = np.multiply(raw, scale, dtype=np.float64)
+    values += offset
+    if raw.dtype.kind == 'f':
+        valid &= ~np.isnan(values)
+    if 'count' in state:
+        np.add(state['count'], 1, out=state['count'], where=valid)
+    if 'sum' in state:
+        np.add(state['sum'], raw if compact else values, out=state['sum'], where=valid)
+    new = np.empty(raw.shape, dtype=bool)
+    if 'max' in state:
+        np.less_equal(values, state['max'], out=new)
+        np.logical_not(new, out=new)
+        new &= valid
+        np.copyto(state['max'], values, where=new)
+        if 'tmax' in state:
+            np.copyto(state['tmax'], t, where=new)
+    if 'min' in state:
+        np.greater_equal(values, state['min'], out=new)
+        np.logical_not(new, out=new)
+        new &= valid
+        np.copyto(state['min'], values, where=new)
+    if 'first' in state:
+        np.fmin(state['first'], t, out=state['first'], where=valid)
+    if 'last' in state:
+        np.fmax(state['last'], t, out=state['last'], where=valid)
+    if 'sumsq' in state:
+        if compact:
+            values = np.multiply(raw, raw, dtype=np.int64)
+        else:
+            np.multiply(values, values, out=values)
+        np.add(state['sumsq'], values, out=state['sumsq'], where=valid)
+
+def updateRaw(state, raw, fill_value=None, scale=1.0, offset=0.0, dqf=None, maxDqf=0, t=None, kernel=None):
+    # Update the accumulators from the raw values of a scene: the fill value
+    # and the pixels with DQF greater than maxDqf are ignored, the scale and
+    # offset are applied pixel by pixel (in the compact states they are applied
+    # in finalizeState)
+    # kernel: 'fused' (fusedKernel, in python without numba) or 'numpy', None
+    # to use fusedKernel only if it is compiled
+    t = np.nan if t is None else t
+    maxDqf = 0 if maxDqf is None else maxDqf
+    compact = isCompact(state)
+    if compact:
+        if raw.dtype.kind not in 'iu':
+            raise ValueError('The compact state needs raw values of integer type')
+        if scale != state['scale'] or offset != state['offset']:
+            raise ValueError('The scale and offset are different from the state')
+        # The values are exact integers in float64
+        scale, offset = 1.0, 0.0
+    if kernel is None:
+        kernel = 'fused' if njit is not None else 'numpy'
+    if kernel == 'numpy' or not raw.flags.c_contiguous:
+        updateRawNumpy(state, raw, fill_value, scale, offset, dqf, maxDqf, t, compact)
+        return
+    empty = np.empty(0)
+    arrays = [state[name].reshape(-1) if name in state else empty for name in KERNEL]
+    if 'count' not in state:
+        arrays[2] = np.empty(0, dtype=np.uint32)
+    flags = np.array([name in state for name in KERNEL])
+    useDqf = dqf is not None
+    dqf = np.ascontiguousarray(dqf, dtype=np.uint8).reshape(-1) if useDqf else np.empty(0, dtype=np.uint8)
+    useFill = fill_value is not None
+    fill = float(fill_value) if useFill else 0.0
+    fusedKernel(raw.reshape(-1), dqf, useDqf, maxDqf, fill, useFill, float(scale), float(offset),
+                float(t), *arrays, flags)
+
+def floatState(state):
+    # Convert a compact state to a float state in place, the accumulators of
+    # the raw values x are converted to the values v = scale * x + offset
+    if not isCompact(state):
+        return state
+    scale = float(state.pop('scale'))
+    offset = float(state.pop('offset'))
+    if 'count' in state:
+        state['count'] = state['count'].astype(np.uint32)
+        count = state['count'].astype(np.float64)
+    raw = state['sum'].astype(np.float64) if 'sum' in state else None
+    if 'sum' in state:
+        state['sum'] = scale * raw + offset * count
+    if 'sumsq' in state:
+        state['sumsq'] = scale * scale * state['sumsq'].astype(np.float64) + 2 * scale * offset * raw \
+            + offset * offset * count
+    for name in ('max', 'min'):
+        if name in state:
+            state[name] = state[name].astype(np.float64) * scale + offset
+    return state
+
+def mergeState(state, other):
+    # Merge the accumulators of other state in state
+    # A compact state merged with a float state, with a different scale or
+    # offset or with too many scenes for its count is converted to float
+    if isCompact(state) or isCompact(other):
+        promote = isCompact(state) != isCompact(other)
+        if not promote:
+            promote = state['scale'] != other['scale'] or state['offset'] != other['offset']
+        if not promote and 'count' in state:
+            promote = (state['count'].astype(np.uint32) + other['count']).max() > np.iinfo(np.uint16).max
+        if promote:
+            floatState(state)
+            other = floatState(dict(other))
+    for name in ('sum', 'sumsq', 'count'):
+        if name in state:
+            state[name] += other[name]
+    if 'max' in state:
+        new = ~np.isnan(other['max']) & ~(other['max'] <= state['max'])
+        state['max'][new] = other['max'][new]
+        if 'tmax' in state:
+            state['tmax'][new] = other['tmax'][new]
+    if 'min' in state:
+        new = ~np.isnan(other['min']) & ~(other['min'] >= state['min'])
+        state['min'][new] = other['min'][new]
+    if 'first' in state:
+        np.fmin(state['first'], other['first'], out=state['first'])
+    if 'last' in state:
+        np.fmax(state['last'], other['last'], out=state['last'])
+
+def saveState(state, path):
+    # Save the accumulators compressed
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    np.savez_compressed(path, **state)
+
+def loadState(path):
+    with np.load(path) as data:
+        return {name: data[name] for name in data.files}
+
+def mergeStates(paths):
+    # Merge the states saved in a list of files
+    state = loadState(paths[0])
+    for path in paths[1:]:
+        mergeState(state, loadState(path))
+    return state
+
+def checkState(state, statistics):
+    # The state must have the accumulators of the statistics
+    missing = [name for name in accumulators(statistics) if name not in state]
+    if len(missing) > 0:
+        raise ValueError('The state does not have the accumulators: ' + ', '.join(missing))
+
+def finalizeState(state, statistic):
+    # Calculate a statistic from the accumulators
+    compact = isCompact(state)
+    if statistic in ('mean', 'std'):
+        count = state['count']
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = state['sum'] / count
+            if statistic == 'std':
+                variance = state['sumsq'] / count - mean * mean
+                mean = np.sqrt(np.maximum(variance, 0))
+                if compact:
+                    mean *= abs(float(state['scale']))
+            elif compact:
+                mean = mean * float(state['scale']) + float(state['offset'])
+        mean[count == 0] = np.nan
+        return mean
+    elif statistic == 'count':
+        return state['count'].astype(float)
+    elif statistic in ('max', 'min') and compact:
+        return state[statistic] * float(state['scale']) + float(state['offset'])
+    return state[statistic].copy()
+
+def checkKernel(shape=(97, 118), scenes=6, seed=0):
+    # Check that fusedKernel and updateRawNumpy give the same accumulators for
+    # synthetic int16 scenes with fill values, DQF and NaN free raw values, in
+    # a float and in a compact state
+    rng = np.random.default_rng(seed)
+    statistics = list(STATISTICS)
+    fill, scale, offset = -32768, 0.0002, -0.05
+    for compact in (False, True):
+        states = {}
+        for kernel in ('fused', 'numpy'):
+            if compact:
+                states[kernel] = createState(shape, statistics, np.int16, scale, offset)
+            else:
+                states[kernel] = createState(shape, statistics)
+        for i in range(scenes):
+            raw = rng.integers(-300, 25000, size=shape).astype(np.int16)
+            raw[rng.random(shape) < 0.2] = fill
+            # Repeated values to check the ties of the maximum
+            raw[:, :4] = 1000
+            dqf = rng.integers(0, 4, size=shape).astype(np.uint8)
+            for kernel in states:
+                updateRaw(states[kernel], raw, fill, scale, offset, dqf, 1, 1.6e9 + 600 * i, kernel)
+        for name in states['fused']:
+            a, b = states['fused'][name], states['numpy'][name]
+            if a.dtype != b.dtype or not np.array_equal(a, b, equal_nan=a.dtype.kind == 'f'):
+                # The sums in float64 can differ in the last bits
+                if a.dtype.kind != 'f' or not np.allclose(a, b, rtol=1e-12, equal_nan=True):
+                    raise AssertionError('The kernels differ in ' + name + (' (compact)' if compact else ''))
+    return True
+
+def timeProduct(aod_tmax, interval):
+    # Convert the timestamps to HHMM UTC for the bins of hour and day, and to
+    # the day of the year for the longer bins
+    out = np.full(aod_tmax.shape, np.nan, dtype=np.float32)
+    valid = ~np.isnan(aod_tmax)
+    seconds = aod_tmax[valid].astype(np.int64)
+    if interval in ('hour', 'day'):
+        seconds = seconds % 86400
+        out[valid] = (seconds // 3600) * 100 + (seconds % 3600) // 60
+    else:
+        days = (seconds // 86400).astype('datetime64[D]')
+        out[valid] = (days - days.astype('datetime64[Y]')).astype(np.int64) + 1
+    return out
+
+if __name__ == "__main__":
+    # Check the kernels (compiled with numba if it is installed)
+    print('Kernels equal: ', checkKernel())
@@ -0,0 +1,234 @@
+'''
+Functions to regrid GOES-16 ABI AOD from the fixed grid to the reference grid
+(ref_AOD.tif, UTM 14N) with a precomputed index of pixels
+
+The index is built once from a sample scene and saved next to the reference
+file, every scene after that is regridded with a gather of numpy. Only the
+window of the source that covers the reference grid (plus a margin) is read.
+
+@author: urielm
+@date: 2026-10-18
+'''
+
+import os
+import hashlib
+import numpy as np
+import rasterio
+from rasterio.crs import CRS
+from rasterio.warp import transform as warpTransform
+from rasterio.windows import Window
+from read_AOD import readAOD
+
+def gridKey(grid):
+    # Short fingerprint of the grid (crs, transform, shape) of the source
+    crs, transform, shape = grid
+    text = CRS.from_user_input(crs).to_wkt() + ' ' + \
+        ' '.join('{:.6f}'.format(v) for v in tuple(transform)[:6]) + ' ' + \
+        ' '.join(str(int(v)) for v in shape)
+    return hashlib.sha1(text.encode()).hexdigest()[:10]
+
+def indexPath(pathRef, method='nearest', grid=None):
+    # The index is saved next to the reference file, one for each grid of
+    # the source (the fixed grid of the NetCDF is not the grid of the GeoTIFF)
+    name = os.path.splitext(pathRef)[0] + '_index_' + method
+    if grid is not None:
+        name += '_' + gridKey(grid)
+    return name + '.npz'
+
+def sourceName(file, var=None):
+    # The NetCDF files are opened as the subdataset of the variable
+    if var is not None:
+        return 'netcdf:' + file + ':' + var
+    return file
+
+def refProfile(pathRef):
+    # Obtain the profile of the reference grid for the output
+    with rasterio.open(pathRef) as ref:
+        profile = {'driver': 'GTiff', 'height': ref.height, 'width': ref.width, 'count': 1,
+                   'dtype': 'float32', 'nodata': np.nan, 'crs': ref.crs, 'transform': ref.transform}
+    return profile
+
+def targetCoords(ref):
+    # Coordinates of the center of each pixel of the reference grid
+    rows, cols = np.mgrid[0:ref.height, 0:ref.width]
+    t = ref.transform
+    xs = t.c + (cols + 0.5) * t.a + (rows + 0.5) * t.b
+    ys = t.f + (cols + 0.5) * t.d + (rows + 0.5) * t.e
+    return xs, ys
+
+def buildIndex(fileSample, pathRef, method='nearest', var=None, margin=2):
+    # Fixed grid of the source
+    with rasterio.open(sourceName(fileSample, var)) as src:
+        srcCrs = src.crs
+        srcTransform = src.transform
+        srcShape = (src.height, src.width)
+    return buildIndexGrid(srcCrs, srcTransform, srcShape, pathRef, method, margin)
+
+def buildIndexGrid(srcCrs, srcTransform, srcShape, pathRef, method='nearest', margin=2):
+    # Reference grid
+    with rasterio.open(pathRef) as ref:
+        xs, ys = targetCoords(ref)
+        dstCrs = ref.crs
+        shape = (ref.height, ref.width)
+
+    # Transform the centers of the reference grid to the crs of the source
+    sx, sy = warpTransform(dstCrs, srcCrs, xs.ravel(), ys.ravel())
+    sx = np.asarray(sx, dtype=float)
+    sy = np.asarray(sy, dtype=float)
+    # Fractional column and row in the source (out of the disk are inf)
+    cols, rows = ~srcTransform * (sx, sy)
+
+    if method == 'nearest':
+        rows = np.floor(rows)[np.newaxis]
+        cols = np.floor(cols)[np.newaxis]
+        weights = np.ones(rows.shape)
+    elif method == 'bilinear':
+        # The four neighbors of the center and their weights
+        r0 = np.floor(rows - 0.5)
+        c0 = np.floor(cols - 0.5)
+        fr = rows - 0.5 - r0
+        fc = cols - 0.5 - c0
+        rows = np.stack([r0, r0, r0 + 1, r0 + 1])
+        cols = np.stack([c0, c0 + 1, c0, c0 + 1])
+        weights = np.stack([(1 - fr) * (1 - fc), (1 - fr) * fc, fr * (1 - fc), fr * fc])
+    else:
+        raise ValueError('Method not recognized: ' + method)
+
+    # Pixels out of the source have weight 0
+    inside = np.isfinite(rows) & np.isfinite(cols)
+    inside &= (rows >= 0) & (rows < srcShape[0]) & (cols >= 0) & (cols < srcShape[1])
+    rows = np.where(inside, rows, 0).astype(np.int32)
+    cols = np.where(inside, cols, 0).astype(np.int32)
+    weights = np.where(inside, weights, 0).astype(np.float32)
+
+    # Window of the source (row_off, col_off, height, width) that covers the
+    # pixels used plus a margin
+    used = weights > 0
+    if not used.any():
+        raise ValueError('The reference grid is out of the source')
+    rowOff = max(int(rows[used].min()) - margin, 0)
+    colOff = max(int(cols[used].min()) - margin, 0)
+    rowEnd = min(int(rows[used].max()) + margin + 1, srcShape[0])
+    colEnd = min(int(cols[used].max()) + margin + 1, srcShape[1])
+    # Rows and columns relative to the window
+    rows = np.where(inside, rows - rowOff, 0).astype(np.int32)
+    cols = np.where(inside, cols - colOff, 0).astype(np.int32)
+
+    k = rows.shape[0]
+    index = {
+        'rows': rows.reshape((k,) + shape),
+        'cols': cols.reshape((k,) + shape),
+        'weights': weights.reshape((k,) + shape),
+        'window': np.array([rowOff, colOff, rowEnd - rowOff, colEnd - colOff]),
+        'srcShape': np.array(srcShape),
+        'srcTransform': np.array(tuple(srcTransform)[:6]),
+    }
+    return index
+
+def saveIndex(index, pathIndex):
+    np.savez(pathIndex, **index)
+
+def loadIndex(pathIndex):
+    with np.load(pathIndex) as data:
+        return {key: data[key] for key in data.files}
+
+def obtainIndex(fileSample, pathRef, method='nearest', var=None):
+    # Load the index if it exists, if not build and save it
+    with rasterio.open(sourceName(fileSample, var)) as src:
+        grid = (src.crs, src.transform, (src.height, src.width))
+    return obtainIndexGrid(grid, pathRef, method)
+
+def obtainIndexGrid(grid, pathRef, method='nearest'):
+    # Like obtainIndex, with the grid (crs, transform, shape) of the source,
+    # the index is built again if it does not correspond to the grid
+    pathIndex = indexPath(pathRef, method, grid)
+    if os.path.exists(pathIndex):
+        index = loadIndex(pathIndex)
+        try:
+            checkGrid(index, grid[1], grid[2])
+            return index
+        except ValueError:
+            print('The index does not correspond to the grid: ', pathIndex)
+    print('Building index: ', pathIndex)
+    index = buildIndexGrid(grid[0], grid[1], grid[2], pathRef, method)
+    saveIndex(index, pathIndex)
+    return index
+
+def checkGrid(index, transform, shape, name=''):
+    # The index is only valid for the same fixed grid of the source
+    if tuple(index['srcShape']) != tuple(shape) or \
+       not np.allclose(index['srcTransform'], tuple(transform)[:6]):
+        raise ValueError('The index does not correspond to the grid of the source ' + name)
+
+def checkIndex(index, src):
+    checkGrid(index, src.transform, (src.height, src.width), src.name)
+
+def indexWindow(index):
+    # Window of rasterio to read from the source (the whole source for the
+    # indexes built without window)
+    if 'window' not in index:
+        return Window(0, 0, int(index['srcShape'][1]), int(index['srcShape'][0]))
+    rowOff, colOff, height, width = [int(v) for v in index['window']]
+    return Window(colOff, rowOff, width, height)
+
+def cropWindow(aod, index):
+    # Cut the window of the index from a whole scene in memory
+    if 'window' not in index:
+        return aod
+    rowOff, colOff, height, width = [int(v) for v in index['window']]
+    return aod[rowOff:rowOff + height, colOff:colOff + width]
+
+def regrid(aod, index, fill_value=None):
+    # Gather the values of the source window for each pixel of the reference grid
+    values = aod[index['rows'], index['cols']].astype(np.float32)
+    valid = (index['weights'] > 0) & ~np.isnan(values)
+    if fill_value is not None:
+        valid &= values != fill_value
+
+    if values.shape[0] == 1:
+        out = values[0]
+        out[~valid[0]] = np.nan
+        return out
+
+    # Weighted average of the valid neighbors
+    weights = np.where(valid, index['weights'], 0)
+    total = weights.sum(axis=0)
+    out = (np.where(valid, values, 0) * weights).sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        out = out / total
+    out[total == 0] = np.nan
+    return out
+
+def regridRaw(raw, index, fill_value):
+    # Nearest gather of the raw values keeping the integer type, the pixels
+    # without source are set to the fill value
+    if index['rows'].shape[0] != 1:
+        raise ValueError('The raw values can only be regridded with the nearest index')
+    out = raw[index['rows'][0], index['cols'][0]]
+    out[index['weights'][0] == 0] = fill_value
+    return out
+
+def regridScene(file, index, output, profile, var=None):
+    # Read the window of the scene, regrid it and save it with the profile of
+    # the reference. The nodata is NaN and the scale and offset of the band
+    # are applied after the regrid (the average of the raw values is linear)
+    with rasterio.open(sourceName(file, var)) as src:
+        checkIndex(index, src)
+        aod = src.read(1, window=indexWindow(index))
+        fill_value = src.nodata
+        scale, offset = src.scales[0], src.offsets[0]
+    aod = regrid(aod, index, fill_value)
+    if scale != 1.0 or offset != 0.0:
+        aod = aod * np.float32(scale) + np.float32(offset)
+    with rasterio.open(output, 'w', **profile) as dst:
+        dst.write(aod.astype(profile['dtype']), 1)
+    return output
+
+def regridNetCDF(file, index, output, profile, var='AOD', quality='all'):
+    # Read only the window of the AOD of the NetCDF (with the quality filter),
+    # regrid it and save it with the profile of the reference
+    window = index['window'] if 'window' in index else None
+    aod = regrid(readAOD(file, var=var, quality=quality, window=window), index)
+    with rasterio.open(output, 'w', **profile) as dst:
+        dst.write(aod.astype(profile['dtype']), 1)
+    return output
@@ -0,0 +1,105 @@
+'''
+Functions to render the products of GOES-16 ABI AOD to PNG without pyplot
+
+The colormap is converted once to a lookup table and applied to the array, the
+colorbar and the strip of the title are cached and composited with PIL. The
+batches of maps are rendered in parallel with a pool of processes.
+
+@author: urielm
+@date: 2026-10-18
+'''
+
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import numpy as np
+from matplotlib import colormaps
+from PIL import Image, ImageDraw, ImageFont
+
+# Size of the map, colorbar and title in pixels
+MAP_SIZE = 480
+BAR_WIDTH = 80
+TITLE_HEIGHT = 30
+# Color of the pixels without data
+BACKGROUND = (255, 255, 255)
+
+@lru_cache(maxsize=None)
+def colormapLUT(cmap='viridis', n=256):
+    # Table of n colors RGB (uint8) of the colormap
+    colors = colormaps[cmap](np.linspace(0, 1, n))[:, :3]
+    return np.round(colors * 255).astype(np.uint8)
+
+def applyLUT(aod, vmin, vmax, cmap='viridis'):
+    # Color of each pixel, the values out of range take the color of the limit
+    lut = colormapLUT(cmap)
+    valid = ~np.isnan(aod)
+    scaled = np.zeros(aod.shape, dtype=np.float32)
+    if vmax > vmin:
+        np.subtract(aod, vmin, out=scaled, where=valid)
+        scaled *= (len(lut) - 1) / (vmax - vmin)
+    index = np.clip(np.rint(scaled), 0, len(lut) - 1).astype(np.intp)
+    rgb = lut[index]
+    rgb[~valid] = BACKGROUND
+    return rgb
+
+def valueRange(aod, vrange):
+    # Fixed range of the product or the range of the valid values
+    if vrange is not None:
+        return float(vrange[0]), float(vrange[1])
+    valid = aod[~np.isnan(aod)]
+    if valid.size == 0:
+        return 0.0, 1.0
+    return float(valid.min()), float(valid.max())
+
+@lru_cache(maxsize=64)
+def colorbar(height, vmin, vmax, cmap='viridis', ticks=6):
+    # Strip with the colorbar and the values of the ticks
+    font = ImageFont.load_default()
+    image = Image.new('RGB', (BAR_WIDTH, height), BACKGROUND)
+    lut = colormapLUT(cmap)
+    top, bottom = 10, height - 10
+    # The maximum is at the top
+    index = np.linspace(len(lut) - 1, 0, bottom - top).round().astype(np.intp)
+    bar = np.repeat(lut[index][:, None, :], 16, axis=1)
+    image.paste(Image.fromarray(bar), (8, top))
+    draw = ImageDraw.Draw(image)
+    for value in np.linspace(vmin, vmax, ticks):
+        y = bottom - 1 - (value - vmin) / (vmax - vmin) * (bottom - top - 1) if vmax > vmin else bottom - 1
+        draw.line([(24, y), (28, y)], fill=(0, 0, 0))
+        draw.text((31, y - 5), '{:.2f}'.format(value), fill=(0, 0, 0), font=font)
+    return image
+
+@lru_cache(maxsize=None)
+def titleStrip(width):
+    # Empty strip of the title, the text is drawn on a copy
+    return Image.new('RGB', (width, TITLE_HEIGHT), BACKGROUND)
+
+def mapScale(shape):
+    # Integer scale of the map so the longer side is about MAP_SIZE
+    return max(1, MAP_SIZE // max(shape))
+
+def renderPNG(aod, path, title, vrange=None, cmap='viridis'):
+    # Map with the colorbar on the right and the title on top
+    vmin, vmax = valueRange(aod, vrange)
+    scale = mapScale(aod.shape)
+    image = Image.fromarray(applyLUT(aod, vmin, vmax, cmap))
+    image = image.resize((aod.shape[1] * scale, aod.shape[0] * scale), Image.NEAREST)
+    width = image.width + BAR_WIDTH
+    out = Image.new('RGB', (width, TITLE_HEIGHT + image.height), BACKGROUND)
+    strip = titleStrip(width).copy()
+    ImageDraw.Draw(strip).text((10, 8), title, fill=(0, 0, 0), font=ImageFont.load_default())
+    out.paste(strip, (0, 0))
+    out.paste(image, (0, TITLE_HEIGHT))
+    out.paste(colorbar(image.height, vmin, vmax, cmap), (image.width, TITLE_HEIGHT))
+    out.save(path, format='PNG', compress_level=1)
+    return path
+
+def renderJob(job):
+    # job: (aod, path, title, vrange)
+    return renderPNG(*job)
+
+def renderBatch(jobs, workers=1):
+    # Render a list of maps, in parallel if workers > 1
+    if workers <= 1:
+        return [renderJob(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(renderJob, jobs, chunksize=max(1, len(jobs) // (4 * workers))))
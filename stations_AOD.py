@@ -0,0 +1,147 @@
+'''
+Functions to extract time series of GOES-16 ABI AOD at monitoring stations
+
+The coordinates (lon, lat) of the stations are converted once to pixels of the
+reference grid (ref_AOD.tif). Then each scene (or each chunk of the cube) is
+read once in the window that covers all the stations, and the value of the
+pixel or the mean of a neighborhood size x size is obtained for all the stations
+with a gather.
+
+@author: urielm
+@date: 2026-10-18
+'''
+
+import numpy as np
+import pandas as pd
+import rasterio
+from rasterio.warp import transform as warpTransform
+from rasterio.windows import Window
+from group_AOD import parseDate
+from cube_AOD import openCube, cubeDates
+from read_AOD import readGeoTIFF
+
+# Open the reference file
+ref = './data/ref/ref_AOD.tif'
+
+def stationPixels(lons, lats, pathRef=ref):
+    # Row and column of the reference grid of each station, -1 if the station
+    # is outside the grid
+    with rasterio.open(pathRef) as src:
+        xs, ys = warpTransform('EPSG:4326', src.crs, list(lons), list(lats))
+        cols, rows = ~src.transform * (np.array(xs), np.array(ys))
+        shape = (src.height, src.width)
+    rows = np.floor(rows).astype(np.int64)
+    cols = np.floor(cols).astype(np.int64)
+    outside = (rows < 0) | (rows >= shape[0]) | (cols < 0) | (cols >= shape[1])
+    rows[outside] = -1
+    cols[outside] = -1
+    return rows, cols
+
+def stationWindow(rows, cols, shape, size=1):
+    # Window of the grid that covers the neighborhoods of all the stations
+    half = size // 2
+    inside = rows >= 0
+    if not inside.any():
+        raise ValueError('All the stations are outside the grid')
+    r0 = max(rows[inside].min() - half, 0)
+    c0 = max(cols[inside].min() - half, 0)
+    r1 = min(rows[inside].max() + half + 1, shape[0])
+    c1 = min(cols[inside].max() + half + 1, shape[1])
+    return Window(c0, r0, c1 - c0, r1 - r0)
+
+def neighbors(rows, cols, window, size=1):
+    # Indices (relative to the window) of the neighborhood of each station,
+    # shape (size * size, stations), -1 outside the window
+    half = size // 2
+    dr, dc = np.mgrid[-half:half + 1, -half:half + 1]
+    r = rows[None, :] + dr.reshape(-1, 1) - window.row_off
+    c = cols[None, :] + dc.reshape(-1, 1) - window.col_off
+    outside = (rows[None, :] < 0) | (r < 0) | (r >= window.height) | (c < 0) | (c >= window.width)
+    r[outside] = -1
+    c[outside] = -1
+    return r, c
+
+def gather(data, r, c):
+    # Mean of the valid values of the neighborhoods, data has shape (h, w) or
+    # (time, h, w), returns (mean, count) with shape (stations,) or (time, stations)
+    values = data[..., np.maximum(r, 0), np.maximum(c, 0)]
+    valid = (r >= 0) & ~np.isnan(values)
+    count = valid.sum(axis=-2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(valid, values, 0).sum(axis=-2) / count
+    mean[count == 0] = np.nan
+    return mean, count
+
+def tidyTable(names, lons, lats, dates, mean, count):
+    # One row for each station and scene
+    n = len(names)
+    return pd.DataFrame({
+        'station': np.tile(np.asarray(names), len(dates)),
+        'lon': np.tile(np.asarray(lons, dtype=float), len(dates)),
+        'lat': np.tile(np.asarray(lats, dtype=float), len(dates)),
+        'time': np.repeat(np.array(dates, dtype='datetime64[s]'), n),
+        'aod': mean.reshape(-1),
+        'count': count.reshape(-1),
+    })
+
+def extractFiles(files, names, lons, lats, size=1, fill_value=-32768.0, pathRef=ref):
+    # Time series of the stations from the GeoTIFF of the scenes
+    rows, cols = stationPixels(lons, lats, pathRef)
+    window = None
+    dates, means, counts = [], [], []
+    for file in sorted(files):
+        if window is None:
+            with rasterio.open(file) as src:
+                window = stationWindow(rows, cols, src.shape, size)
+            r, c = neighbors(rows, cols, window, size)
+        # Decoded like the aggregation: scale, offset and nodata
+        data = readGeoTIFF(file, window, fill_value)
+        mean, count = gather(data, r, c)
+        dates.append(parseDate(file))
+        means.append(mean)
+        counts.append(count)
+    if len(dates) == 0:
+        return tidyTable(names, lons, lats, [], np.empty((0, len(names))), np.empty((0, len(names))))
+    return tidyTable(names, lons, lats, dates, np.stack(means), np.stack(counts))
+
+def extractCube(years, names, lons, lats, size=1, pathRef=ref):
+    # Time series of the stations from the cubes of the years, one read of the
+    # window of the stations for each chunk of time
+    rows, cols = stationPixels(lons, lats, pathRef)
+    tables = []
+    for year in years:
+        nc = openCube(year)
+        try:
+            dates = cubeDates(nc)
+            aod = nc.variables['AOD']
+            aod.set_auto_mask(False)
+            window = stationWindow(rows, cols, aod.shape[1:], size)
+            r, c = neighbors(rows, cols, window, size)
+            batch = aod.chunking()[0]
+            means, counts = [], []
+            for t in range(0, len(dates), batch):
+                data = aod[t:t + batch, window.row_off:window.row_off + window.height,
+                           window.col_off:window.col_off + window.width]
+                mean, count = gather(data, r, c)
+                means.append(mean)
+                counts.append(count)
+        finally:
+            nc.close()
+        if len(dates) > 0:
+            tables.append(tidyTable(names, lons, lats, dates, np.concatenate(means), np.concatenate(counts)))
+    if len(tables) == 0:
+        return tidyTable(names, lons, lats, [], np.empty((0, len(names))), np.empty((0, len(names))))
+    return pd.concat(tables, ignore_index=True)
+
+def extractStations(stations, years=None, files=None, size=1, pathRef=ref):
+    # stations: DataFrame with the columns name, lon and lat
+    # The series are read from the cubes of the years or from a list of files
+    names, lons, lats = stations['name'].values, stations['lon'].values, stations['lat'].values
+    if years is not None:
+        return extractCube(years, names, lons, lats, size, pathRef)
+    return extractFiles(files, names, lons, lats, size, pathRef=pathRef)
+
+if __name__ == "__main__":
+    stations = pd.read_csv('./data/stations/stations.csv')
+    table = extractStations(stations, years=['2018', '2019', '2020', '2021', '2022', '2023'], size=3)
+    table.to_csv('/data/tmp/AOD_average/stations_AOD.csv', index=False)
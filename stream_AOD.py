@@ -0,0 +1,124 @@
+'''
+Script to obtain the statistics of GOES-16 ABI AOD directly from the tar files
+of the depot, without writing NetCDF or GeoTIFF files
+
+Each member of AOD is read from the tar in memory, decoded, regridded to the
+reference grid and accumulated. Several tar files are decoded at the same time
+with a pool of processes.
+
+With compact=True the raw integers of the AOD are regridded (nearest) and
+accumulated without decoding, in a compact state (see reduce_AOD).
+
+@author: urielm
+@date: 2026-10-18
+'''
+
+import os
+import re
+import datetime
+from concurrent.futures import ProcessPoolExecutor
+from depot_goes_get_data import depot_goes_directory, depot_goes_plan, \
+    depot_goes_tar_indice, depot_goes_tar_miembros, depot_goes_tar_lee
+from read_AOD import QUALITY, readAOD, readAODRaw, fixedGrid
+from regrid_AOD import obtainIndexGrid, regrid, regridRaw
+from reduce_AOD import timestamp, createState, updateState, updateRaw, saveState
+from aggregate_AOD import STATE_STATISTICS, ref, obtainProducts, statePath, saveProducts
+from output_AOD import outputProfile, backgroundWriter, flushWrites
+
+def sceneDate(name):
+    # Date of the scene from the name "..._s20231821801171_..."
+    r = re.search(r'_s(\d{13})', os.path.basename(name))
+    return datetime.datetime.strptime(r.group(1), '%Y%j%H%M%S')
+
+def sampleGrid(datafile, product='AOD'):
+    # Fixed grid of the first member of AOD of a tar
+    indice = depot_goes_tar_indice(datafile)
+    member = depot_goes_tar_miembros(indice, [product])[0]
+    return fixedGrid(data=depot_goes_tar_lee(datafile, member, indice))
+
+def decodeTar(datafile, index, product='AOD', hours=(12, 24), quality='all', compact=False):
+    # Decode in memory the members of AOD of a tar and regrid them, the errors
+    # are returned so one bad file does not stop the batch
+    # compact: the scenes are (raw, fill_value, scale_factor, add_offset, dqf)
+    scenes = []
+    try:
+        indice = depot_goes_tar_indice(datafile)
+        for member in depot_goes_tar_miembros(indice, [product]):
+            date = sceneDate(member[0])
+            # Filter date to range  12:00 - 24:00
+            if date.hour < hours[0] or date.hour >= hours[1]:
+                continue
+            data = depot_goes_tar_lee(datafile, member, indice)
+            if compact:
+                raw, fill_value, scale, offset, dqf = readAODRaw(data=data, quality=quality,
+                                                                 window=index['window'])
+                if dqf is not None:
+                    dqf = regridRaw(dqf, index, 255)
+                scenes.append((date, (regridRaw(raw, index, fill_value), fill_value, scale, offset, dqf)))
+                continue
+            # Only the window of the region is decoded
+            aod = readAOD(data=data, quality=quality, window=index['window'])
+            scenes.append((date, regrid(aod, index)))
+    except Exception as e:
+        return datafile, scenes, repr(e)
+    return datafile, scenes, None
+
+def main(fecha1, fecha2, products, workers=4, nivel='l2', dominio='conus', method='nearest',
+         quality='all', compact=False):
+    # quality: DQF of the pixels accumulated, 'high', 'medium', 'low' or 'all'
+    # compact: accumulate the raw integers (only with method 'nearest')
+    if compact and method != 'nearest':
+        raise ValueError('The compact state needs the method nearest')
+    # Plan the tar files of each day (each week directory is read once)
+    directorio = depot_goes_directory('abi', nivel, dominio)
+    fechas = depot_goes_plan(fecha1, fecha2, directorio)
+    tars = [datafile for fecha in fechas for datafile in fechas[fecha]]
+    if len(tars) == 0:
+        print('No files to process')
+        return []
+
+    # Index of pixels from the fixed grid of the first tar
+    index = obtainIndexGrid(sampleGrid(tars[0]), ref, method)
+
+    products = obtainProducts(products)
+    statistics = [product['statistic'] for product in products]
+    accumulate = statistics + [s for s in STATE_STATISTICS if s not in statistics]
+    profile = outputProfile(ref)
+    writer = backgroundWriter()
+
+    failed = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for fecha in fechas:
+            year = str(fecha // 1000)
+            date = '{:03d}'.format(fecha % 1000)
+            print('Day: ', year, date)
+            state = None
+            # The results arrive in the same order as the tar files
+            n = len(fechas[fecha])
+            results = executor.map(decodeTar, fechas[fecha], [index] * n, ['AOD'] * n, [(12, 24)] * n,
+                                   [quality] * n, [compact] * n)
+            for datafile, scenes, error in results:
+                if error is not None:
+                    print('Error: ', datafile, error)
+                    failed.append((datafile, error))
+                for t, aod in scenes:
+                    if compact:
+                        raw, fill_value, scale, offset, dqf = aod
+                        if state is None:
+                            state = createState(raw.shape, accumulate, raw.dtype, scale, offset)
+                        updateRaw(state, raw, fill_value, scale, offset, dqf, QUALITY[quality], timestamp(t))
+                        continue
+                    if state is None:
+                        state = createState(aod.shape, accumulate)
+                    updateState(state, aod, timestamp(t))
+            if state is None:
+                print('No data for the day ', year, date)
+                continue
+            saveState(state, statePath('day', year, date))
+            saveProducts(state, products, 'day', year, date, profile, writer=writer)
+    flushWrites(writer, close=True)
+    print('Failed files: ', len(failed))
+    return failed
+
+if __name__ == "__main__":
+    main(2023001, 2023365, ['avr', 'max', 'tmax', 'min', 'std', 'count'])
@@ -0,0 +1,144 @@
+'''
+Functions to obtain statistics of GOES-16 ABI AOD by municipality
+
+The polygons of the municipalities are rasterized once on the reference grid
+(ref_AOD.tif) and the raster of labels is saved next to the reference file.
+The mean, maximum, number of valid pixels and valid fraction of all the
+municipalities are obtained from each scene with bincount, and the results are
+written as a table scene x municipality.
+
+@author: urielm
+@date: 2026-10-18
+'''
+
+import os
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import rasterio
+from rasterio.features import rasterize
+from group_AOD import parseDate
+from cube_AOD import openCube, cubeDates, readScenes
+from read_AOD import readGeoTIFF
+
+pathRegion = '/home/urielm/AOD_average/data/region/Municipios/Municipios_MM.shp'
+pathRef = '/home/urielm/AOD_average/data/ref/ref_AOD.tif'
+
+def labelsPath(pathRef, pathRegion):
+    # The labels are saved next to the reference file
+    region = os.path.splitext(os.path.basename(pathRegion))[0]
+    return os.path.splitext(pathRef)[0] + '_zones_' + region + '.tif'
+
+def buildLabels(pathRegion, pathRef, field='NOMGEO'):
+    # Rasterize the polygons on the reference grid, the label of each polygon
+    # is its position + 1 (0 is outside of all the polygons)
+    with rasterio.open(pathRef) as ref:
+        profile = {'driver': 'GTiff', 'height': ref.height, 'width': ref.width, 'count': 1,
+                   'dtype': 'int32', 'nodata': 0, 'crs': ref.crs, 'transform': ref.transform}
+    region = gpd.read_file(pathRegion).to_crs(profile['crs'])
+    if field in region.columns:
+        names = [str(name) for name in region[field]]
+    else:
+        names = [str(i) for i in region.index]
+    labels = rasterize(((geom, i + 1) for i, geom in enumerate(region.geometry)),
+                       out_shape=(profile['height'], profile['width']), transform=profile['transform'],
+                       fill=0, dtype='int32')
+    return labels, names, profile
+
+def saveLabels(labels, names, profile, path):
+    # The names of the zones are saved in the tags of the GeoTIFF
+    with rasterio.open(path, 'w', **profile) as dst:
+        dst.write(labels, 1)
+        dst.update_tags(**{'ZONE_' + str(i + 1): name for i, name in enumerate(names)})
+
+def loadLabels(path):
+    with rasterio.open(path) as src:
+        labels = src.read(1)
+        tags = src.tags()
+    names = [tags['ZONE_' + str(i + 1)] for i in range(len([t for t in tags if t.startswith('ZONE_')]))]
+    return labels, names
+
+def obtainLabels(pathRegion=pathRegion, pathRef=pathRef, field='NOMGEO'):
+    # Load the labels if they exist and are newer than the region, otherwise
+    # rasterize and save them
+    path = labelsPath(pathRef, pathRegion)
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(pathRegion):
+        return loadLabels(path)
+    print('Rasterizing the zones: ', pathRegion)
+    labels, names, profile = buildLabels(pathRegion, pathRef, field)
+    saveLabels(labels, names, profile, path)
+    return labels, names
+
+def zoneIndex(labels, names):
+    # Precomputed order of the pixels by zone, for the sums with bincount and
+    # the maximum with reduceat
+    labels = labels.reshape(-1)
+    n = len(names) + 1
+    total = np.bincount(labels, minlength=n)
+    present = np.nonzero(total)[0]
+    return {'names': names, 'labels': labels, 'total': total,
+            'order': np.argsort(labels, kind='stable'), 'present': present,
+            # First pixel of each zone with pixels in the sorted order
+            'starts': np.concatenate(([0], np.cumsum(total)))[present]}
+
+def zoneStats(zones, aod):
+    # Mean, maximum, count and valid fraction of each zone (without the 0)
+    n = len(zones['total'])
+    aod = aod.reshape(-1)
+    valid = ~np.isnan(aod)
+    labels = zones['labels'][valid]
+    count = np.bincount(labels, minlength=n)
+    sums = np.bincount(labels, weights=aod[valid], minlength=n)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = sums / count
+        fraction = count / zones['total']
+    mean[count == 0] = np.nan
+    values = np.where(valid, aod, -np.inf)[zones['order']]
+    maximum = np.full(n, -np.inf)
+    maximum[zones['present']] = np.maximum.reduceat(values, zones['starts'])
+    maximum[maximum == -np.inf] = np.nan
+    return mean[1:], maximum[1:], count[1:], fraction[1:]
+
+def zonesTable(zones, scenes):
+    # Table scene x municipality from a list of (name, date, stats)
+    columns = {'scene': [], 'time': [], 'zone': [], 'name': [], 'mean': [], 'max': [],
+               'count': [], 'valid_fraction': []}
+    n = len(zones['names'])
+    for scene, date, (mean, maximum, count, fraction) in scenes:
+        columns['scene'] += [scene] * n
+        columns['time'] += [date] * n
+        columns['zone'].append(np.arange(1, n + 1))
+        columns['name'] += zones['names']
+        columns['mean'].append(mean)
+        columns['max'].append(maximum)
+        columns['count'].append(count)
+        columns['valid_fraction'].append(fraction)
+    for name in ('zone', 'mean', 'max', 'count', 'valid_fraction'):
+        columns[name] = np.concatenate(columns[name]) if len(columns[name]) > 0 else []
+    return pd.DataFrame(columns)
+
+def zonesFiles(files, zones, fill_value=-32768.0):
+    # Statistics by zone of the GeoTIFF of scenes or of products
+    scenes = []
+    for file in sorted(files):
+        # Decoded like the aggregation: scale, offset and nodata
+        aod = readGeoTIFF(file, fill_value=fill_value)
+        scenes.append((os.path.basename(file), parseDate(file), zoneStats(zones, aod)))
+    return zonesTable(zones, scenes)
+
+def zonesCube(year, zones):
+    # Statistics by zone of the scenes of the cube of the year
+    nc = openCube(year)
+    try:
+        dates = cubeDates(nc)
+        names = nc.variables['scene'][:]
+        scenes = [(names[i], dates[i], zoneStats(zones, aod)) for i, aod in readScenes(nc, range(len(dates)))]
+    finally:
+        nc.close()
+    return zonesTable(zones, scenes)
+
+if __name__ == "__main__":
+    zones = zoneIndex(*obtainLabels())
+    for year in ['2018', '2019', '2020', '2021', '2022', '2023']:
+        table = zonesCube(year, zones)
+        table.to_csv('/data/tmp/AOD_average/zones_AOD_' + year + '.csv', index=False)